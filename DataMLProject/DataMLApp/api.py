@@ -0,0 +1,269 @@
+"""JSON API over merged_data, served by async views.
+
+SQLite queries and pandas work run in a bounded thread pool (API_THREADS)
+so they never block the event loop under ASGI. Responses are cached per
+data version and carry an ETag and Last-Modified for conditional requests;
+listing exports are streamed from a database cursor as CSV or NDJSON.
+"""
+import asyncio
+import base64
+import binascii
+import csv
+import functools
+import hashlib
+import io
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.cache import cache
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import condition, require_safe
+from rest_framework.exceptions import APIException, NotFound, ValidationError
+from rest_framework.utils.urls import replace_query_param
+
+import data_access
+import recommender
+from aggregates import AGGREGATES
+from .serializers import ListingExportSerializer, ListingFilterSerializer, RecommendationQuerySerializer
+
+# Seconds a response stays in the cache; a new data version changes the key anyway
+CACHE_TIMEOUT = 300
+
+# Threads running the SQLite queries of the API: at most this many queries at a time per process
+API_THREADS = int(os.environ.get('DATAML_API_THREADS', 8))
+
+# Threads reading and encoding exports: long exports never queue ahead of the API queries
+EXPORT_THREADS = int(os.environ.get('DATAML_EXPORT_THREADS', 2))
+
+# Rows fetched from the cursor per streamed chunk of an export
+EXPORT_BATCH_SIZE = 1000
+
+EXPORT_CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+}
+
+LISTING_COLUMNS = [
+    'id', 'name', 'listing_url', 'picture_url', 'country', 'city', 'neighbourhood_cleansed', 'room_type',
+    'property_type', 'price', 'beds', 'review_scores_rating', 'latitude', 'longitude',
+]
+
+_executor = ThreadPoolExecutor(max_workers=API_THREADS, thread_name_prefix='dataml-api')
+_export_executor = ThreadPoolExecutor(max_workers=EXPORT_THREADS, thread_name_prefix='dataml-export')
+
+
+async def run_blocking(func, *args, executor=_executor):
+    """Run ``func(*args)`` in a thread pool (by default the API one) and return its result."""
+    return await asyncio.get_running_loop().run_in_executor(executor, functools.partial(func, *args))
+
+
+def data_etag(request, *args, **kwargs):
+    return hashlib.sha1(f'{request.data_version}:{request.get_full_path()}'.encode('utf-8')).hexdigest()
+
+
+def data_last_modified(request, *args, **kwargs):
+    return data_access.data_version_timestamp(request.data_version)
+
+
+def data_view(view):
+    """Make ``view`` a GET (and HEAD) endpoint revalidated against the data version.
+
+    ETag and Last-Modified follow the data version, so clients revalidate
+    with a 304; API exceptions become JSON errors. The version is read once
+    per request, in the thread pool, and kept on ``request.data_version``.
+    """
+    @condition(etag_func=data_etag, last_modified_func=data_last_modified)
+    @functools.wraps(view)
+    async def conditional(request, *args, **kwargs):
+        try:
+            return await view(request, *args, **kwargs)
+        except APIException as exc:
+            detail = exc.detail if isinstance(exc.detail, (dict, list)) else {'detail': exc.detail}
+            return JsonResponse(detail, status=exc.status_code, safe=False)
+
+    @require_safe
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        # get_data_version stats the database and may query it: keep it off the event loop
+        request.data_version = await run_blocking(data_access.get_data_version)
+        return await conditional(request, *args, **kwargs)
+    return wrapper
+
+
+async def cached(request, compute):
+    key = f'dataml-api:{data_etag(request)}'
+    value = await cache.aget(key)
+    if value is None:
+        value = await run_blocking(compute)
+        await cache.aset(key, value, CACHE_TIMEOUT)
+    return value
+
+
+def validated(serializer_class, request):
+    params = serializer_class(data=request.GET)
+    params.is_valid(raise_exception=True)
+    return params.validated_data
+
+
+def records(df):
+    # JSON has no NaN: missing values become null
+    return df.astype(object).where(df.notna(), None).to_dict(orient='records')
+
+
+def encode_cursor(rowid):
+    return base64.urlsafe_b64encode(str(rowid).encode('ascii')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    if not cursor:
+        return 0
+    try:
+        return int(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('ascii'))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise ValidationError({'cursor': 'Invalid cursor.'})
+
+
+@data_view
+async def stats(request, name=None):
+    """Summary tables materialized at ingest time, all of them or one by name."""
+    if name is not None and name not in AGGREGATES:
+        raise NotFound(f'Unknown aggregate: {name}')
+    names = list(AGGREGATES) if name is None else [name]
+    return JsonResponse(await cached(request, lambda: {
+        aggregate: records(data_access.load_aggregate(aggregate)) for aggregate in names}))
+
+
+def listing_conditions(filters):
+    """Return the WHERE conditions and their parameters for the listing filters."""
+    where, args = [], []
+    for field, column in (('country', 'country'), ('room_type', 'room_type')):
+        if field in filters:
+            where.append(f'{column} = ?')
+            args.append(filters[field])
+    if filters.get('neighbourhood'):
+        where.append(f"neighbourhood_cleansed IN ({', '.join('?' * len(filters['neighbourhood']))})")
+        args.extend(filters['neighbourhood'])
+    for field, condition_sql in (('min_price', 'price >= ?'), ('max_price', 'price <= ?'),
+                                 ('min_rating', 'review_scores_rating >= ?')):
+        if field in filters:
+            where.append(condition_sql)
+            args.append(filters[field])
+    return where, args
+
+
+def listing_columns(conn):
+    existing = set(data_access.table_columns(conn, data_access.TABLE_NAME))
+    return [column for column in LISTING_COLUMNS if column in existing]
+
+
+@data_view
+async def listings(request):
+    """Filtered listing search with keyset (cursor) pagination on the table rowid."""
+    filters = validated(ListingFilterSerializer, request)
+    return JsonResponse(await cached(request, lambda: search_listings(request, filters)))
+
+
+def search_listings(request, filters):
+    where, args = listing_conditions(filters)
+    where.insert(0, 'rowid > ?')
+    args.insert(0, decode_cursor(filters.get('cursor')))
+    page_size = filters['page_size']
+
+    with data_access.get_engine().connect() as conn:
+        columns = listing_columns(conn)
+        rows = conn.exec_driver_sql(
+            f"SELECT rowid, {', '.join(columns)} FROM {data_access.TABLE_NAME} "
+            f"WHERE {' AND '.join(where)} ORDER BY rowid LIMIT ?",
+            tuple(args) + (page_size + 1,)).fetchall()
+
+    next_url = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_url = replace_query_param(request.build_absolute_uri(), 'cursor', encode_cursor(rows[-1][0]))
+    return {'next': next_url, 'results': [dict(zip(columns, row[1:])) for row in rows]}
+
+
+def open_export(filters):
+    """Run the export query and return (connection, cursor, columns); rows are read lazily from the cursor."""
+    where, args = listing_conditions(filters)
+    conn = data_access.get_engine().raw_connection()
+    try:
+        cursor = conn.cursor()
+        columns = [row[1] for row in cursor.execute(f"PRAGMA table_info({data_access.TABLE_NAME})")]
+        columns = [column for column in LISTING_COLUMNS if column in columns]
+        cursor.execute(
+            f"SELECT {', '.join(columns)} FROM {data_access.TABLE_NAME} "
+            f"WHERE {' AND '.join(where) or '1'} ORDER BY rowid", tuple(args))
+        return conn, cursor, columns
+    except Exception:
+        conn.close()
+        raise
+
+
+def encode_rows(output, columns, rows, header=False):
+    if output == 'ndjson':
+        return ''.join(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + '\n' for row in rows).encode('utf-8')
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(columns)
+    writer.writerows(rows)
+    return buffer.getvalue().encode('utf-8')
+
+
+async def stream_export(output, filters):
+    # Une seule page de lignes en mémoire à la fois, quelle que soit la taille de l'export
+    conn, cursor, columns = await run_blocking(open_export, filters, executor=_export_executor)
+
+    def next_chunk():
+        # Lecture et encodage hors de la boucle d'événements
+        rows = cursor.fetchmany(EXPORT_BATCH_SIZE)
+        return encode_rows(output, columns, rows) if rows else None
+
+    try:
+        if output == 'csv':
+            yield encode_rows(output, columns, [], header=True)
+        while (chunk := await run_blocking(next_chunk, executor=_export_executor)) is not None:
+            yield chunk
+    finally:
+        # Connexion rendue au pool, y compris quand le client se déconnecte
+        await run_blocking(conn.close, executor=_export_executor)
+
+
+@data_view
+async def export_listings(request):
+    """All the listings matching the filters, streamed as CSV or NDJSON (``?format=``)."""
+    filters = validated(ListingExportSerializer, request)
+    output = filters['format']
+    response = StreamingHttpResponse(stream_export(output, filters), content_type=EXPORT_CONTENT_TYPES[output])
+    response['Content-Disposition'] = f'attachment; filename="listings.{output}"'
+    return response
+
+
+@data_view
+async def recommendations(request):
+    """Recommendations for a country, room type and preferred feature values.
+
+    Only the RERANK_CANDIDATES listings closest to the query are ranked and
+    paged; ``next_page`` is null on the last page.
+    """
+    query = validated(RecommendationQuerySerializer, request)
+    return JsonResponse(await cached(request, lambda: recommend(query)))
+
+
+def recommend(query):
+    preferences = {feature: query[feature] for feature in recommender.NEIGHBOUR_FEATURES if feature in query}
+    try:
+        result = recommender.recommend(query['country'], query['room_type'], preferences,
+                                       backend=query['backend'], page=query['page'])
+    except LookupError as exc:
+        raise NotFound(str(exc))
+    return {
+        'backend': result['backend'],
+        'cluster': result['cluster'],
+        'page': result['page'],
+        'n_pages': result['n_pages'],
+        'next_page': result['next_page'],
+        'results': records(result['listings']),
+    }
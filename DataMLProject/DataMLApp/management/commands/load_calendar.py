@@ -0,0 +1,103 @@
+import csv
+import gzip
+import os
+import time
+from operator import itemgetter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+import calendar_series
+from DataMLApp.models import Calendar
+from db import BULK_LOAD_PRAGMAS, apply_pragmas, batch_insert, create_connection, execute_query
+
+COLUMNS = ['listing_id', 'date', 'available', 'price', 'adjusted_price', 'minimum_nights', 'maximum_nights']
+
+
+def find_calendar_files(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in sorted(os.walk(path)):
+                for name in sorted(files):
+                    if name in ('calendar.csv', 'calendar.csv.gz'):
+                        yield os.path.join(root, name)
+        elif os.path.exists(path):
+            yield path
+        else:
+            raise CommandError(f"{path} does not exist")
+
+
+def parse_price(value):
+    return value.replace('$', '').replace(',', '')
+
+
+def read_calendar(path):
+    """Yield insert-ready tuples from an Airbnb calendar.csv; rows missing a required value are skipped."""
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8', newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        columns = itemgetter(*(header.index(column) for column in COLUMNS))
+        for row in reader:
+            listing_id, date, available, price, adjusted_price, minimum_nights, maximum_nights = columns(row)
+            if not (listing_id and date and price and minimum_nights and maximum_nights):
+                continue
+            price = parse_price(price)
+            yield (
+                int(listing_id), date, available[:1], price,
+                parse_price(adjusted_price) if adjusted_price else price,
+                int(minimum_nights), int(maximum_nights),
+            )
+
+
+class Command(BaseCommand):
+    help = "Stream Airbnb calendar.csv files into the Calendar table in batched transactions"
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help="calendar.csv(.gz) files or directories to search")
+        parser.add_argument('--batch-size', type=int, default=50_000, help="rows per INSERT transaction")
+        parser.add_argument('--truncate', action='store_true', help="delete the existing calendar rows first")
+        parser.add_argument('--skip-series', action='store_true',
+                            help="do not update the occupancy and price series afterwards")
+
+    def handle(self, *args, **options):
+        table = Calendar._meta.db_table
+        database = str(settings.DATABASES['default']['NAME'])
+        connection = create_connection(database)
+        # Bulk load: the data can be reloaded from the CSVs if a crash interrupts it
+        apply_pragmas(connection, BULK_LOAD_PRAGMAS)
+        indexes = []
+        if options['truncate']:
+            execute_query(connection, f"DELETE FROM {table}")
+            # Filling an empty table is faster with the indexes rebuilt once at the end
+            indexes = connection.execute(
+                "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL",
+                (table,)).fetchall()
+            for name, _ in indexes:
+                execute_query(connection, f'DROP INDEX "{name}"')
+
+        query = (f"INSERT INTO {table} ({', '.join(COLUMNS)}) "
+                 f"VALUES ({', '.join('?' * len(COLUMNS))})")
+        total, start = 0, time.perf_counter()
+        try:
+            for path in find_calendar_files(options['paths']):
+                file_start = time.perf_counter()
+                # One executemany and one commit per batch
+                file_rows = batch_insert(connection, query, read_calendar(path), options['batch_size'])
+                elapsed = time.perf_counter() - file_start
+                self.stdout.write(f"{path}: {file_rows} rows in {elapsed:.2f}s "
+                                  f"({file_rows / max(elapsed, 1e-9):,.0f} rows/s)")
+                total += file_rows
+        finally:
+            for _, sql in indexes:
+                execute_query(connection, sql)
+            connection.close()
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f"Loaded {total} calendar rows in {elapsed:.2f}s ({total / max(elapsed, 1e-9):,.0f} rows/s)"))
+
+        if not options['skip_series']:
+            # After a truncate every period may have changed
+            rows = calendar_series.update_calendar_series(database, rebuild=options['truncate'])
+            self.stdout.write(f"Occupancy and price series updated from {rows} calendar rows")
@@ -0,0 +1,15 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('DataMLApp', '0002_alter_calendar_id'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='calendar',
+            index=models.Index(fields=['listing_id', 'date'], name='calendar_listing_date_idx'),
+        ),
+    ]
@@ -0,0 +1,15 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('DataMLApp', '0003_calendar_listing_date_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='calendar',
+            index=models.Index(fields=['date'], name='calendar_date_idx'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('DataMLApp', '0004_calendar_date_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ListingRating',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('listing_id', models.BigIntegerField(unique=True)),
+                ('rating_count', models.IntegerField(default=0)),
+                ('rating_sum', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Rating',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('listing_id', models.BigIntegerField()),
+                ('rater_id', models.CharField(max_length=64)),
+                ('rating', models.PositiveSmallIntegerField()),
+                ('updated_at', models.DateTimeField()),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('listing_id', 'rater_id'), name='rating_listing_rater_uniq')],
+            },
+        ),
+    ]
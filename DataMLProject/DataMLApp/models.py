@@ -8,3 +8,29 @@ class Calendar(models.Model):
     adjusted_price = models.DecimalField(max_digits=10, decimal_places=2)
     minimum_nights = models.IntegerField()
     maximum_nights = models.IntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['listing_id', 'date'], name='calendar_listing_date_idx'),
+            models.Index(fields=['date'], name='calendar_date_idx'),
+        ]
+
+
+class Rating(models.Model):
+    """Last rating (1 to 5) given to a listing by one visitor of the recommender."""
+    listing_id = models.BigIntegerField()
+    rater_id = models.CharField(max_length=64)
+    rating = models.PositiveSmallIntegerField()
+    updated_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['listing_id', 'rater_id'], name='rating_listing_rater_uniq'),
+        ]
+
+
+class ListingRating(models.Model):
+    """Per-listing totals of Rating, kept up to date by ratings.py when it writes a batch."""
+    listing_id = models.BigIntegerField(unique=True)
+    rating_count = models.IntegerField(default=0)
+    rating_sum = models.IntegerField(default=0)
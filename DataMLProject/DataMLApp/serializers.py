@@ -0,0 +1,34 @@
+from rest_framework import serializers
+
+import recommender
+
+
+class ListingConditionsSerializer(serializers.Serializer):
+    country = serializers.CharField(required=False)
+    neighbourhood = serializers.ListField(child=serializers.CharField(), required=False)
+    room_type = serializers.CharField(required=False)
+    min_price = serializers.FloatField(required=False)
+    max_price = serializers.FloatField(required=False)
+    min_rating = serializers.FloatField(required=False)
+
+
+class ListingFilterSerializer(ListingConditionsSerializer):
+    cursor = serializers.CharField(required=False)
+    page_size = serializers.IntegerField(required=False, min_value=1, max_value=500, default=50)
+
+
+class ListingExportSerializer(ListingConditionsSerializer):
+    format = serializers.ChoiceField(choices=['csv', 'ndjson'], default='csv')
+
+
+class RecommendationQuerySerializer(serializers.Serializer):
+    country = serializers.CharField()
+    room_type = serializers.CharField()
+    backend = serializers.ChoiceField(choices=[recommender.KMEANS, recommender.NEIGHBOURS], default=recommender.KMEANS)
+    price = serializers.FloatField(required=False)
+    beds = serializers.FloatField(required=False)
+    review_scores_rating = serializers.FloatField(required=False)
+    availability_365 = serializers.FloatField(required=False)
+    latitude = serializers.FloatField(required=False)
+    longitude = serializers.FloatField(required=False)
+    page = serializers.IntegerField(required=False, min_value=1, default=1)
@@ -1,3 +1,440 @@
-from django.test import TestCase
-
-# Create your tests here.
+import csv
+import io
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import SimpleTestCase
+
+import data_access
+import db
+import ml_models
+import ratings
+import recommender
+import schema
+from aggregates import materialize_aggregates
+from prepare_data import REQUIRED_COLUMNS, clean_data
+
+
+def listings(**columns):
+    rows = {
+        'id': [1, 2, 3],
+        'price': ['$1,234.50', '$80.00', '$80.00'],
+        'neighbourhood': ['Paris, Île-de-France, France'] * 3,
+        'room_type': ['Entire home/apt', 'Private room', 'Private room'],
+        'latitude': [48.85, 48.86, 48.87],
+        'longitude': [2.35, 2.36, 2.37],
+        'last_review': ['2023-01-05', '2023-11-30', '2022-06-15'],
+    }
+    rows.update(columns)
+    return pd.DataFrame(rows)
+
+
+class CleanDataTests(SimpleTestCase):
+
+    def clean(self, df):
+        return clean_data(df, required=REQUIRED_COLUMNS)
+
+    def test_prices_are_parsed(self):
+        df = self.clean(listings())
+        self.assertEqual(df['price'].tolist(), [1234.5, 80.0, 80.0])
+
+    def test_non_numeric_prices_drop_the_row(self):
+        df = self.clean(listings(price=['$12.00', 'gratuit', None]))
+        self.assertEqual(df['id'].tolist(), [1])
+
+    def test_numeric_prices_are_kept(self):
+        df = self.clean(listings(price=[10.0, 20.5, 30.0]))
+        self.assertEqual(df['price'].tolist(), [10.0, 20.5, 30.0])
+
+    def test_repeated_cities_are_all_kept(self):
+        df = self.clean(listings())
+        self.assertEqual(df['city'].tolist(), ['Paris'] * 3)
+        self.assertEqual(df['country'].tolist(), ['France'] * 3)
+
+    def test_city_and_country_aliases(self):
+        df = self.clean(listings(neighbourhood=[
+            'París, Île-de-France, FR',
+            'Milano, Lombardia, Lombardia',
+            'Greater London, England, England',
+        ]))
+        self.assertEqual(df['city'].tolist(), ['Paris', 'Milan', 'London'])
+        self.assertEqual(df['department'].tolist(), ['Île-de-France', 'Lombardia', 'England'])
+        self.assertEqual(df['country'].tolist(), ['France', 'Italy', 'United Kingdom'])
+
+    def test_city_case_and_spaces_are_normalized(self):
+        df = self.clean(listings(neighbourhood=['LYON , Rhône, France', 'lyon, Rhône, France', 'Lyon, Rhône, France']))
+        self.assertEqual(df['city'].tolist(), ['Lyon'] * 3)
+
+    def test_short_neighbourhood_leaves_missing_parts(self):
+        df = self.clean(listings(neighbourhood=['Paris', 'Paris, Île-de-France, France', 'Rome, Lazio']))
+        self.assertEqual(df['city'].tolist(), ['Paris', 'Paris', 'Rome'])
+        self.assertTrue(pd.isna(df['country'].iloc[0]))
+        self.assertTrue(pd.isna(df['country'].iloc[2]))
+
+    def test_locations_are_categorical(self):
+        df = self.clean(listings())
+        for col in ('city', 'department', 'country'):
+            self.assertIsInstance(df[col].dtype, pd.CategoricalDtype)
+        self.assertNotIn('neighbourhood', df.columns)
+
+    def test_duplicates_are_removed_by_id(self):
+        df = self.clean(listings(id=[1, 1, 2]))
+        self.assertEqual(df['id'].tolist(), [1, 2])
+        self.assertEqual(df['price'].tolist(), [1234.5, 80.0])
+
+    def test_identical_rows_with_different_ids_are_kept(self):
+        df = self.clean(listings(price=['$80.00'] * 3, room_type=['Private room'] * 3,
+                                 latitude=[48.85] * 3, longitude=[2.35] * 3))
+        self.assertEqual(len(df), 3)
+
+    def test_required_columns_drop_incomplete_rows_only(self):
+        df = self.clean(listings(latitude=[48.85, None, 48.87], license=[None, None, None]))
+        self.assertEqual(df['id'].tolist(), [1, 3])
+        self.assertIn('license', df.columns)
+
+    def test_sparse_columns_are_dropped_without_required(self):
+        df = clean_data(listings(license=[None, None, 'ABC']))
+        self.assertNotIn('license', df.columns)
+        self.assertEqual(len(df), 3)
+
+    def test_dates_are_datetimes(self):
+        df = self.clean(listings(last_review=['2023-01-05', 'pas de date', None]))
+        self.assertTrue(pd.api.types.is_datetime64_any_dtype(df['last_review']))
+        self.assertEqual(df['last_review'].iloc[0], pd.Timestamp('2023-01-05'))
+        self.assertTrue(df['last_review'].iloc[1:].isna().all())
+
+    def test_dates_are_stored_as_iso_text(self):
+        stored = schema.to_storage(self.clean(listings(last_review=['2023-01-05', None, '2022-06-15'])))
+        self.assertEqual(stored['last_review'].tolist(), ['2023-01-05', None, '2022-06-15'])
+        self.assertEqual(stored['price'].dtype, np.float64)
+
+    def test_amenities_are_dropped(self):
+        df = self.clean(listings(amenities=['["Wifi"]'] * 3))
+        self.assertNotIn('amenities', df.columns)
+
+
+class ClusterModelTests(SimpleTestCase):
+
+    def test_rows_with_missing_features_are_left_out(self):
+        data = pd.DataFrame({
+            'id': range(6),
+            'price': [50.0, 60.0, 70.0, 200.0, 210.0, 220.0],
+            'original_price': [50.0, 60.0, 70.0, 200.0, 210.0, 220.0],
+            'beds': [1.0, np.nan, 1.0, 3.0, 3.0, np.nan],
+        })
+        model = ml_models.fit_cluster_model(data, ['price', 'beds'], n_clusters=2)
+        self.assertEqual(len(model.labels), 4)
+        self.assertEqual(sorted(model.ranked_ids.tolist()), [0, 2, 3, 4])
+
+
+def merged_data(rows_per_type):
+    """merged_data rows of France, ``{room_type: number of listings}``."""
+    frames, first_id = [], 1
+    for room_type, n in rows_per_type.items():
+        ids = np.arange(first_id, first_id + n)
+        first_id += n
+        frames.append(pd.DataFrame({
+            'id': ids,
+            'name': [f'Logement {i}' for i in ids],
+            'listing_url': [f'https://www.airbnb.com/rooms/{i}' for i in ids],
+            'picture_url': 'https://a0.muscache.com/pictures/1.jpg',
+            'country': 'France',
+            'city': 'Paris',
+            'neighbourhood_cleansed': np.where(ids % 2, 'Louvre', 'Opéra'),
+            'room_type': room_type,
+            'property_type': 'Entire rental unit',
+            'price': 40.0 + (ids % 30) * 10,
+            'beds': 1.0 + ids % 3,
+            'review_scores_rating': 3.0 + (ids % 5) / 2,
+            'availability_365': ids % 365,
+            'latitude': 48.85 + ids / 1e4,
+            'longitude': 2.35 + ids / 1e4,
+            'last_scraped': '2023-12-12',
+            'last_review': '2023-06-01',
+        }))
+    return pd.concat(frames, ignore_index=True)
+
+
+def create_rating_tables(path):
+    """Create the rating tables in ``path`` with the SQL of their migration."""
+    sql = io.StringIO()
+    call_command('sqlmigrate', 'DataMLApp', '0005', stdout=sql)
+    conn = sqlite3.connect(path)
+    conn.executescript(sql.getvalue())
+    conn.close()
+
+
+class RatingDatabaseTestCase(SimpleTestCase):
+    """Runs against the rating tables in a temporary directory."""
+
+    # sqlmigrate reads the migration history of the test database
+    databases = {'default'}
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp_dir = tmp.name
+        self.ratings_path = os.path.join(tmp.name, 'db.sqlite3')
+        create_rating_tables(self.ratings_path)
+        patcher = mock.patch.dict(ratings._stats, {ratings.RATINGS_DB: ratings.RatingStats(self.ratings_path)})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(db.dispose_engines)
+
+
+class RatingWriteTests(RatingDatabaseTestCase):
+
+    def ratings(self, listing_id):
+        row = ratings.listing_ratings([listing_id], self.ratings_path).iloc[0]
+        return int(row['rating_count']), row['rating_mean']
+
+    def test_queued_ratings_of_a_visitor_are_coalesced(self):
+        queue = ratings.RatingQueue(self.ratings_path, flush_size=100, flush_seconds=60)
+        queue.submit(1, 'alice', 2)
+        queue.submit(1, 'alice', 5)
+        queue.submit(2, 'alice', 3)
+        self.assertEqual(queue.pending(), {(1, 'alice'): 5, (2, 'alice'): 3})
+        self.assertEqual(queue.flush(), 2)
+        self.assertEqual(queue.pending(), {})
+        self.assertEqual(self.ratings(1), (1, 5.0))
+        self.assertEqual(self.ratings(2), (1, 3.0))
+        self.assertEqual(queue.flush(), 0)
+
+    def test_rating_out_of_range_is_rejected(self):
+        queue = ratings.RatingQueue(self.ratings_path)
+        with self.assertRaises(ValueError):
+            queue.submit(1, 'alice', 6)
+        self.assertEqual(queue.pending(), {})
+
+    def test_rerating_replaces_the_previous_rating(self):
+        at = '2024-01-01 00:00:00.000000'
+        self.assertEqual(ratings.write_batch(self.ratings_path, {(1, 'alice'): (4, at), (1, 'bob'): (2, at)}),
+                         {1: (2, 6)})
+        self.assertEqual(ratings.write_batch(self.ratings_path, {(1, 'alice'): (5, at)}), {1: (0, 1)})
+        self.assertEqual(ratings.write_batch(self.ratings_path, {(1, 'alice'): (5, at)}), {1: (0, 0)})
+        self.assertEqual(self.ratings(1), (2, 3.5))
+
+    def test_unmigrated_database_has_no_ratings(self):
+        path = os.path.join(self.tmp_dir, 'unmigrated.sqlite3')
+        with self.assertLogs('ratings', 'WARNING') as logs:
+            self.assertTrue(ratings.listing_ratings([1], path).empty)
+            self.assertTrue(ratings.listing_ratings([2], path).empty)
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn('manage.py migrate', logs.output[0])
+        queue = ratings.RatingQueue(path)
+        queue.submit(1, 'alice', 4)
+        with self.assertRaises(ratings.MissingTablesError):
+            queue.flush()
+        self.assertEqual(queue.pending(), {})
+
+
+class RatingStatsTests(RatingDatabaseTestCase):
+
+    at = '2024-01-01 00:00:00.000000'
+
+    def test_written_batches_update_the_totals(self):
+        stats = ratings.RatingStats(self.ratings_path)
+        self.assertEqual(stats.get(1), (0, 0))
+        stats.write({(1, 'alice'): (4, self.at), (1, 'bob'): (2, self.at)})
+        stats.write({(1, 'alice'): (5, self.at)})
+        self.assertEqual(stats.get(1), (2, 7))
+        counts, means = stats.scores(np.array([1, 2]))
+        self.assertEqual(counts.tolist(), [2, 0])
+        self.assertAlmostEqual(means[0], (ratings.PRIOR_WEIGHT * ratings.PRIOR_MEAN + 7) / (ratings.PRIOR_WEIGHT + 2))
+        self.assertEqual(means[1], ratings.PRIOR_MEAN)
+
+    def test_reload_during_a_write_does_not_count_the_batch_twice(self):
+        stats = ratings.RatingStats(self.ratings_path, reload_seconds=0)
+        stats.get(1)
+        write_batch = ratings.write_batch
+        reader = threading.Thread(target=stats.get, args=(1,))
+
+        def write_then_read(*args):
+            # A reader reloading right after the commit must wait for the totals to be updated
+            totals = write_batch(*args)
+            reader.start()
+            reader.join(0.2)
+            return totals
+
+        with mock.patch('ratings.write_batch', write_then_read):
+            stats.write({(1, 'alice'): (4, self.at)})
+        stats.reload_seconds = float('inf')
+        reader.join()
+        self.assertEqual(stats.get(1), (1, 4))
+
+
+class RerankTests(RatingDatabaseTestCase):
+
+    def rerank(self, prices, reviews, target_price=100):
+        ids = np.arange(1, len(prices) + 1)
+        stats = ratings.RatingStats(self.ratings_path)
+        return recommender.rerank(ids, np.array(prices, dtype=float), np.array(reviews, dtype=float),
+                                  target_price, stats).tolist()
+
+    def test_closest_price_first(self):
+        self.assertEqual(self.rerank([300, 110, 100], [4, 4, 4]), [3, 2, 1])
+
+    def test_review_scores_outweigh_a_small_price_gap(self):
+        self.assertEqual(self.rerank([100, 110], [2, 5]), [2, 1])
+
+    def test_missing_review_counts_as_the_middle_of_the_scale(self):
+        self.assertEqual(self.rerank([100, 100, 100], [2, np.nan, 3]), [3, 2, 1])
+
+    def test_visitor_ratings_break_ties(self):
+        ratings.write_batch(self.ratings_path, {(2, f'visitor{i}'): (5, '2024-01-01 00:00:00.000000')
+                                                for i in range(10)})
+        self.assertEqual(self.rerank([100, 100, 100], [4, 4, 4]), [2, 1, 3])
+
+
+class ListingDatabaseTestCase(RatingDatabaseTestCase):
+    """Also runs against merged_data and its aggregates."""
+
+    rows_per_type = {'Entire home/apt': 60, 'Hotel room': 7}
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(data_access, 'DB_PATH', os.path.join(self.tmp_dir, 'airbnb_data.db'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.reset_caches)
+        self.reset_caches()
+        self.data = merged_data(self.rows_per_type)
+        with data_access.get_writer().begin() as conn:
+            schema.to_storage(self.data).to_sql(data_access.TABLE_NAME, conn, index=False)
+            materialize_aggregates(conn)
+        data_access.write_data_version(data_access.get_writer())
+
+    @staticmethod
+    def reset_caches():
+        data_access.clear_cache()
+        ml_models.model_cache.clear()
+        cache.clear()
+        db.dispose_engines()
+
+
+class RecommendationApiTests(ListingDatabaseTestCase):
+
+    def test_kmeans_recommendations(self):
+        response = self.client.get('/api/recommendations/', {
+            'country': 'France', 'room_type': 'Entire home/apt', 'price': 100, 'beds': 2})
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual(body['backend'], 'kmeans')
+        self.assertIsNotNone(body['cluster'])
+        self.assertTrue(body['results'])
+
+    def test_small_slice_falls_back_to_nearest_neighbours(self):
+        response = self.client.get('/api/recommendations/', {'country': 'France', 'room_type': 'Hotel room'})
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual(body['backend'], 'neighbours')
+        self.assertIsNone(body['cluster'])
+        self.assertEqual(len(body['results']), 7)
+
+    def test_pages_end_at_the_ranked_candidates(self):
+        query = {'country': 'France', 'room_type': 'Entire home/apt', 'backend': 'neighbours', 'price': 100}
+        with mock.patch('recommender.RERANK_CANDIDATES', 25):
+            first = self.client.get('/api/recommendations/', query).json()
+            last = self.client.get('/api/recommendations/', {**query, 'page': 3}).json()
+        self.assertEqual((first['n_pages'], first['next_page']), (3, 2))
+        self.assertEqual(len(last['results']), 5)
+        self.assertIsNone(last['next_page'])
+
+    def test_unknown_slice_is_not_found(self):
+        response = self.client.get('/api/recommendations/', {'country': 'Nowhere', 'room_type': 'Hotel room'})
+        self.assertEqual(response.status_code, 404)
+
+
+class ListingApiTests(ListingDatabaseTestCase):
+
+    def test_unchanged_data_revalidates_with_304(self):
+        response = self.client.get('/api/stats/agg_country_price/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['agg_country_price'][0]['listings'], 67)
+        etag = response.headers['ETag']
+        self.assertTrue(response.headers['Last-Modified'])
+        self.assertEqual(self.client.get('/api/stats/agg_country_price/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        data_access.write_data_version(data_access.get_writer())
+        response = self.client.get('/api/stats/agg_country_price/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+    def test_unknown_aggregate_is_not_found(self):
+        self.assertEqual(self.client.get('/api/stats/nope/').status_code, 404)
+
+    def test_write_methods_are_not_allowed(self):
+        self.assertEqual(self.client.post('/api/stats/').status_code, 405)
+
+    def test_cursor_pagination_walks_every_listing_once(self):
+        ids, url = [], '/api/listings/?room_type=Entire%20home/apt&page_size=25'
+        while url:
+            body = self.client.get(url).json()
+            self.assertLessEqual(len(body['results']), 25)
+            ids.extend(listing['id'] for listing in body['results'])
+            url = body['next']
+        self.assertEqual(ids, list(range(1, 61)))
+
+    def test_invalid_cursor_is_rejected(self):
+        response = self.client.get('/api/listings/', {'cursor': '!!'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('cursor', response.json())
+
+    async def export(self, **params):
+        response = await self.async_client.get('/api/listings/export/', params)
+        self.assertEqual(response.status_code, 200)
+        return b''.join([chunk async for chunk in response.streaming_content]).decode('utf-8')
+
+    async def test_csv_export_streams_the_matching_listings(self):
+        with mock.patch('DataMLApp.api.EXPORT_BATCH_SIZE', 2):
+            rows = list(csv.DictReader(io.StringIO(await self.export(room_type='Hotel room'))))
+        self.assertEqual([int(row['id']) for row in rows], list(range(61, 68)))
+        self.assertEqual(rows[0]['room_type'], 'Hotel room')
+
+    async def test_ndjson_export(self):
+        lines = (await self.export(format='ndjson', min_price=300)).splitlines()
+        listings = [json.loads(line) for line in lines]
+        self.assertEqual(len(listings), int((self.data['price'] >= 300).sum()))
+        self.assertTrue(all(listing['price'] >= 300 for listing in listings))
+
+
+class ColumnCacheTests(ListingDatabaseTestCase):
+
+    def test_cached_columns_are_served_during_a_cold_read(self):
+        data_access.load_columns(['price'])
+        reading, release, reads = threading.Event(), threading.Event(), []
+        read_columns = data_access._read_columns
+
+        def slow_read(version, columns):
+            reads.append(columns)
+            reading.set()
+            release.wait(5)
+            return read_columns(version, columns)
+
+        with mock.patch('data_access._read_columns', slow_read):
+            cold = [threading.Thread(target=data_access.load_columns, args=(['id', 'beds'],)) for _ in range(3)]
+            for thread in cold:
+                thread.start()
+            reading.wait(5)
+            hit = threading.Thread(target=data_access.load_columns, args=(['price'],))
+            hit.start()
+            hit.join(2)
+            self.assertFalse(hit.is_alive())
+            release.set()
+            for thread in cold:
+                thread.join()
+        self.assertEqual(reads, [['id', 'beds']])
+        self.assertEqual(data_access.load_columns(['beds', 'price'])['beds'].tolist(), self.data['beds'].tolist())
+
+    def test_aggregates_are_read_once_per_data_version(self):
+        with mock.patch('pandas.read_sql_query', wraps=pd.read_sql_query) as read:
+            data_access.load_aggregate('agg_country_price')
+            data_access.load_aggregate('agg_country_price')
+            self.assertEqual(read.call_count, 1)
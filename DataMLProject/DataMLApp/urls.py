@@ -1,8 +1,13 @@
 from django.urls import path
-from . import views
+from . import api, views
 
 urlpatterns = [
     path('', views.index, name='index'),
     path(r'stats/', views.stats, name='stats'),
     path(r'ml/', views.ml, name='ml'),
+    path(r'api/stats/', api.stats, name='api-stats'),
+    path(r'api/stats/<str:name>/', api.stats, name='api-stats-detail'),
+    path(r'api/listings/', api.listings, name='api-listings'),
+    path(r'api/listings/export/', api.export_listings, name='api-listings-export'),
+    path(r'api/recommendations/', api.recommendations, name='api-recommendations'),
 ]
\ No newline at end of file
@@ -90,7 +90,26 @@ WSGI_APPLICATION = 'DataMLProject.wsgi.application'
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        # Also the ratings database of ratings.py, which reads the same variable
+        'NAME': os.environ.get('DATAML_RATINGS_DB', BASE_DIR / 'db.sqlite3'),
+        # Same connection settings as db.py: WAL so that API reads and calendar loads do not block each other
+        'OPTIONS': {
+            'init_command': ('PRAGMA journal_mode = WAL; PRAGMA synchronous = NORMAL; '
+                             'PRAGMA mmap_size = 268435456; PRAGMA temp_store = MEMORY'),
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 30,
+        },
+    }
+}
+
+
+# Cache
+# Responses of the JSON API are cached per data version (see DataMLApp/api.py)
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'dataml-api',
     }
 }
 
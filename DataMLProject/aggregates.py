@@ -0,0 +1,72 @@
+"""Summary tables materialized from merged_data at ingest time.
+
+Each aggregate is a SELECT over merged_data plus the columns to index. The
+ingest stores the results in their own tables and the dashboard reads them
+directly instead of grouping the full listing table on every render.
+"""
+
+SOURCE_TABLE = 'merged_data'
+
+AGGREGATES = {
+    # Prix moyen par quartier et type de chambre (heatmap)
+    'agg_neighbourhood_room_type_price': (
+        f"""SELECT neighbourhood_cleansed, room_type, AVG(price) AS price, COUNT(*) AS listings
+            FROM {SOURCE_TABLE}
+            WHERE neighbourhood_cleansed IS NOT NULL AND room_type IS NOT NULL
+            GROUP BY neighbourhood_cleansed, room_type""",
+        ['neighbourhood_cleansed', 'room_type'],
+    ),
+    # Prix moyen et centre de chaque ville (treemap, cartes)
+    'agg_city_price': (
+        f"""SELECT city, AVG(price) AS price, COUNT(*) AS listings,
+                   AVG(latitude) AS latitude, AVG(longitude) AS longitude
+            FROM {SOURCE_TABLE}
+            WHERE city IS NOT NULL
+            GROUP BY city""",
+        ['city'],
+    ),
+    # Prix moyen par pays (bar chart)
+    'agg_country_price': (
+        f"""SELECT country, AVG(price) AS price, COUNT(*) AS listings
+            FROM {SOURCE_TABLE}
+            WHERE country IS NOT NULL
+            GROUP BY country""",
+        ['country'],
+    ),
+    # Prix moyen par pays et quartier (section 10), avec la somme des carrés des écarts à la moyenne
+    # pour l'intervalle de confiance (centrée : pas de perte de précision quand la dispersion est faible)
+    'agg_country_neighbourhood_price': (
+        f"""SELECT country, neighbourhood_cleansed, AVG(price) AS price, COUNT(*) AS listings,
+                   SUM((price - group_price) * (price - group_price)) AS price_sq_dev
+            FROM (SELECT country, neighbourhood_cleansed, price,
+                         AVG(price) OVER (PARTITION BY country, neighbourhood_cleansed) AS group_price
+                  FROM {SOURCE_TABLE}
+                  WHERE country IS NOT NULL AND neighbourhood_cleansed IS NOT NULL AND price IS NOT NULL)
+            GROUP BY country, neighbourhood_cleansed""",
+        ['country', 'neighbourhood_cleansed'],
+    ),
+    # Disponibilité moyenne par date de scraping
+    'agg_availability_by_date': (
+        f"""SELECT last_scraped, AVG(availability_365) AS availability_365
+            FROM {SOURCE_TABLE}
+            WHERE last_scraped IS NOT NULL
+            GROUP BY last_scraped""",
+        ['last_scraped'],
+    ),
+    # Nombre de dernières reviews par mois (dates stockées au format ISO YYYY-MM-DD)
+    'agg_review_months': (
+        f"""SELECT CAST(substr(last_review, 6, 2) AS INTEGER) AS review_month, COUNT(*) AS count
+            FROM {SOURCE_TABLE}
+            WHERE last_review IS NOT NULL
+            GROUP BY review_month""",
+        ['review_month'],
+    ),
+}
+
+
+def materialize_aggregates(conn):
+    """(Re)build every aggregate table from merged_data inside the caller's transaction."""
+    for name, (query, index_columns) in AGGREGATES.items():
+        conn.exec_driver_sql(f"DROP TABLE IF EXISTS {name}")
+        conn.exec_driver_sql(f"CREATE TABLE {name} AS {query}")
+        conn.exec_driver_sql(f"CREATE INDEX idx_{name} ON {name} ({', '.join(index_columns)})")
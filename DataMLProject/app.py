@@ -1,38 +1,62 @@
 import streamlit as st
 import pandas as pd
-import matplotlib.pyplot as plt
 import seaborn as sns
 import plotly.express as px
-from sqlalchemy import create_engine
-import folium
-from folium.plugins import MarkerCluster
-from streamlit_folium import st_folium
+import plotly.io as pio
 import matplotlib.colors as colors
 import numpy as np
 import pydeck as pdk
-
-# Charger les données depuis la base de données
-def load_data():
-    engine = create_engine('sqlite:///airbnb_data.db')
-    query = "SELECT * FROM merged_data"
-    return pd.read_sql_query(query, engine)
-
-# Préparation des données pour le heatmap
+import calendar_series
+import chart_cache
+import data_access
+import spatial
+
+# Colonnes utilisées par chaque section du tableau de bord
+SECTION_COLUMNS = {
+    'property_types': ['property_type'],
+    'room_type_prices': ['room_type', 'price'],
+    'superhost': ['host_is_superhost', 'price', 'review_scores_rating'],
+    'rating_map': ['review_scores_value', 'latitude', 'longitude', 'neighborhood_overview'],
+    'price_map': ['price', 'latitude', 'longitude'],
+}
+
+# Groupes de sections du tableau de bord (les cartes ne sont calculées que lorsqu'elles sont affichées)
+OVERVIEW = "Vue d'ensemble"
+RATING_MAP = 'Carte des notes'
+NEIGHBOURHOOD_PRICES = 'Prix par quartier'
+PRICE_MAP = 'Carte des prix'
+SECTION_GROUPS = [OVERVIEW, RATING_MAP, NEIGHBOURHOOD_PRICES, PRICE_MAP]
+
+# Une section en fragment ne relance qu'elle-même quand ses widgets changent
+# (st.fragment depuis Streamlit 1.37 ; sans lui, tout le script est relancé comme avant)
+fragment = getattr(st, 'fragment', None) or getattr(st, 'experimental_fragment', None) or (lambda func: func)
+
+MONTH_LABELS = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+
+# Charger les données depuis la base de données (uniquement les colonnes de la section, en cache pour le processus)
+def load_data(section):
+    return data_access.load_columns(SECTION_COLUMNS[section])
+
+# Seaborn trace une barre par catégorie : les catégories absentes après un filtre sont retirées
+def drop_unused_categories(df):
+    return df.apply(lambda col: col.cat.remove_unused_categories() if isinstance(col.dtype, pd.CategoricalDtype) else col)
+
+# Préparation des données pour le heatmap (à partir de la table agrégée par quartier et type de chambre)
 def prepare_heatmap_data(df, by='neighbourhood_cleansed', column='room_type', values='price'):
-    heatmap_data = df.groupby([by, column])[values].mean().unstack().fillna(0)
+    heatmap_data = df.pivot(index=by, columns=column, values=values).fillna(0)
     return heatmap_data
 
 # Fonction pour créer le heatmap
 def create_heatmap(data):
     st.subheader("Heatmap des prix moyens par quartier et type de chambre")
-    plt.figure(figsize=(12, 8))
-    heatmap = sns.heatmap(data, cmap="YlGnBu")
-    plt.title('Prix moyen par quartier et type de chambre')
-    plt.xlabel('Type de chambre')
-    plt.ylabel('Quartier')
-    plt.xticks(rotation=45)
-    plt.yticks(rotation=0)
-    st.pyplot()
+    def build(fig, ax):
+        sns.heatmap(data, cmap="YlGnBu", ax=ax)
+        ax.set_title('Prix moyen par quartier et type de chambre')
+        ax.set_xlabel('Type de chambre')
+        ax.set_ylabel('Quartier')
+        ax.tick_params(axis='x', rotation=45)
+        ax.tick_params(axis='y', rotation=0)
+    st.image(chart_cache.png_chart('heatmap', None, build, figsize=(12, 8)))
     st.write("""
         Cette heatmap présente une cartographie détaillée des prix moyens selon les quartiers et les types de chambres sur Airbnb. Chaque intersection de quartier et de type de chambre est représentée par une couleur variant du vert clair au vert foncé, où les teintes plus sombres signalent des prix plus élevés. Cette visualisation permet de déceler les tendances de tarification dans différentes localités et selon la nature du logement. Les quartiers centraux et les sites touristiques, comme prévu, tendent à afficher des prix plus élevés. C'est le cas, par exemple, de "Mayfair" ou de certains quartiers parisiens. Le heatmap fournit un aperçu instantané de la stratégie de tarification et peut indiquer des zones de haute valeur pour les investisseurs immobiliers ou les hôtes cherchant à maximiser leurs revenus sur Airbnb. L'échelle de couleur utilisée est intuitive : plus la couleur est foncée, plus le prix moyen est élevé, ce qui permet même aux novices en données de saisir rapidement l'information clé.
         """)
@@ -40,10 +64,12 @@ def create_heatmap(data):
 # Fonction pour créer un treemap des villes avec les prix moyens des logements
 def plot_city_treemap(df):
     st.subheader("Treemap des villes avec les prix moyens des logements")
-    city_avg_price = df.groupby('city')['price'].mean().reset_index()
-    fig = px.treemap(city_avg_price, path=['city'], values='price', title='Treemap des villes avec les prix moyens des logements')
-    fig.data[0].hovertemplate = 'Ville: %{label}<br>Prix moyen: $%{value:.2f}'
-    st.plotly_chart(fig, use_container_width=True)
+    def build():
+        city_avg_price = df[['city', 'price']]
+        fig = px.treemap(city_avg_price, path=['city'], values='price', title='Treemap des villes avec les prix moyens des logements')
+        fig.data[0].hovertemplate = 'Ville: %{label}<br>Prix moyen: $%{value:.2f}'
+        return fig
+    st.plotly_chart(pio.from_json(chart_cache.plotly_chart('city_treemap', None, build)), use_container_width=True)
     st.write("""
         Le treemap est une représentation proportionnelle où chaque ville est un bloc dont la taille et la couleur varient selon le prix moyen des logements. Les grandes sections sombres pour "Mayfair" et "Paris 16E" attirent immédiatement l'attention, suggérant non seulement des prix moyens élevés mais aussi probablement une concentration de logements haut de gamme ou une demande accrue. À l'inverse, des villes avec des blocs plus petits et plus clairs pourraient indiquer des marchés plus accessibles. Cette vue peut être extrêmement utile pour les voyageurs qui budgettent leur voyage, ainsi que pour les hôtes qui évaluent le positionnement de leur tarif par rapport aux autres villes. Le treemap est un excellent outil de comparaison rapide qui montre comment les prix varient significativement d'une ville à l'autre, et il met également en évidence la diversité des marchés immobiliers au sein du réseau Airbnb.
         """)
@@ -51,22 +77,18 @@ def plot_city_treemap(df):
 # Affichage du prix moyen par pays sous forme de bar chart
 def plot_bar_chart(df):
     st.subheader("Prix moyens par pays")
-    neighborhood_data = df.groupby('country')['price'].mean().sort_values()
-
-    # Generate a color palette with distinct colors for each country
-    colors = sns.color_palette('husl', len(neighborhood_data))
-
-    # Plotting the bar chart with Seaborn for better styling
-    plt.figure(figsize=(10, 6))
-    sns.barplot(x=neighborhood_data.index, y=neighborhood_data.values, palette=colors)
-    plt.xlabel('Pays')
-    plt.ylabel('Prix moyen')
-    plt.title('Prix moyens des locations Airbnb par pays')
-
-    # Adding legend
-    legend_labels = [f"{country}: {price:.2f} €" for country, price in
-                     zip(neighborhood_data.index, neighborhood_data.values)]
-    st.pyplot()
+    neighborhood_data = df.set_index('country')['price'].sort_values()
+
+    def build(fig, ax):
+        # Generate a color palette with distinct colors for each country
+        colors = sns.color_palette('husl', len(neighborhood_data))
+
+        # Plotting the bar chart with Seaborn for better styling
+        sns.barplot(x=neighborhood_data.index, y=neighborhood_data.values, palette=colors, ax=ax)
+        ax.set_xlabel('Pays')
+        ax.set_ylabel('Prix moyen')
+        ax.set_title('Prix moyens des locations Airbnb par pays')
+    st.image(chart_cache.png_chart('country_prices', None, build))
     st.write("""
     Le graphique montre les tarifs moyens des locations Airbnb dans quatre pays européens. Les Pays-Bas affichent les prix les plus élevés, suivis de près par le Royaume-Uni. La France se situe légèrement en dessous, tandis que l'Italie propose les prix les plus bas. Ces variations peuvent refléter la demande, la disponibilité des logements et les stratégies de tarification compétitives. Ces données sont cruciales pour les voyageurs dans la planification budgétaire et pour les hôtes dans l'ajustement de leur stratégie de tarification. Pour Airbnb, ces informations sont essentielles pour identifier les opportunités de marché et ajuster les stratégies de tarification.
     """)
@@ -74,10 +96,10 @@ def plot_bar_chart(df):
 # Affichage de la répartition des types de logements sous forme de diagramme circulaire
 def plot_property_types_pie(df):
     st.subheader('Répartition des 6 grands types de logements')
-    top_property_types = df['property_type'].value_counts().head(6)
-    fig, ax = plt.subplots()
-    ax.pie(top_property_types, labels=top_property_types.index, autopct='%1.1f%%')
-    st.pyplot(fig)
+    def build(fig, ax):
+        top_property_types = df['property_type'].value_counts().head(6)
+        ax.pie(top_property_types, labels=top_property_types.index, autopct='%1.1f%%')
+    st.image(chart_cache.png_chart('property_types', None, build, figsize=(6.4, 4.8)))
     st.write("""
     Le diagramme circulaire concernant la "Répartition des 6 grands types de logements" révèle que la majorité des propriétés disponibles sont des "Entire rental unit", indiquant une forte préférence des utilisateurs d'Airbnb pour des logements entiers. Cela peut refléter le désir des voyageurs pour plus d'espace, de confort et de confidentialité. Les autres catégories, comme les "Entire lofts" et les "Private rooms in home", occupent des segments plus petits, ce qui implique que bien qu'il y ait une demande pour ces types de logements, elle est considérablement moindre comparée à celle pour des logements entiers. Cette information est utile pour les hôtes lors de la mise en marché de leur propriété et peut également indiquer où Airbnb pourrait étendre son offre pour satisfaire la demande.
     """)
@@ -85,16 +107,55 @@ def plot_property_types_pie(df):
 # Affichage de la disponibilité moyenne des annonces au fil du temps sous forme de graphique linéaire
 def plot_availability_over_time(df):
     st.subheader('Disponibilité moyenne des annonces au fil du temps')
-    availability = df.groupby('last_scraped')['availability_365'].mean()
-    plt.plot(availability.index, availability.values)
-    plt.xlabel('Date')
-    plt.ylabel('Disponibilité moyenne (sur 365 jours)')
-    plt.title('Disponibilité moyenne des annonces au fil du temps')
-    st.pyplot()
+    cities = calendar_series.series_cities()
+    if cities:
+        plot_occupancy_series(cities)
+    else:
+        # Sans données de calendrier : disponibilité moyenne par date de scraping, triée chronologiquement
+        def build(fig, ax):
+            availability = (df.dropna(subset=['last_scraped']).sort_values('last_scraped')
+                            .set_index('last_scraped')['availability_365'])
+            ax.plot(availability.index, availability.values)
+            ax.set_xlabel('Date')
+            ax.set_ylabel('Disponibilité moyenne (sur 365 jours)')
+            ax.set_title('Disponibilité moyenne des annonces au fil du temps')
+        st.image(chart_cache.png_chart('availability_by_date', None, build, figsize=(6.4, 4.8)))
     st.write("""
     En ce qui concerne la "Disponibilité moyenne des annonces au fil du temps", nous voyons des fluctuations significatives tout au long de la période représentée. La chute nette de la disponibilité à mi-parcours suggère une période de forte occupation ou une restriction temporaire de l'offre. Le pic remarquable en décembre pourrait être attribué aux vacances de Noël, quand les propriétaires choisissent de mettre leurs biens sur le marché pour profiter de la demande saisonnière. Ces données sont essentielles pour les hôtes Airbnb qui peuvent vouloir ajuster leur disponibilité en prévision des variations saisonnières de la demande, et pour les voyageurs cherchant à comprendre les meilleures périodes pour trouver des options de logement disponibles.
     """)
 
+@fragment
+def plot_occupancy_series(cities):
+    # Taux d'occupation et prix médians calculés à partir du calendrier (requête par plage de dates)
+    city = st.selectbox('Ville :', cities, key='occupancy_city')
+    neighbourhood = st.selectbox('Quartier :', ['Toute la ville'] + calendar_series.series_neighbourhoods(city),
+                                 key='occupancy_neighbourhood')
+    freq = st.radio('Granularité :', ['monthly', 'daily'], horizontal=True, key='occupancy_freq',
+                    format_func={'monthly': 'Mois', 'daily': 'Jour'}.get)
+    neighbourhood = None if neighbourhood == 'Toute la ville' else neighbourhood
+    # Les séries du calendrier ne suivent pas la version de merged_data : leur estampille fait partie de la clé.
+    # Elle est lue avant les séries, pour qu'une mise à jour concurrente ne laisse pas un graphique périmé en cache
+    series_version = calendar_series.series_version()
+    series = calendar_series.load_series(city, neighbourhood, freq=freq)
+    if series.empty:
+        st.write("Aucune donnée de calendrier pour cette sélection.")
+        return
+
+    def build(fig, axes):
+        ax_occupancy, ax_price = axes
+        period = pd.to_datetime(series['period'])
+        ax_occupancy.plot(period, series['occupancy_rate'] * 100)
+        ax_occupancy.set_ylabel("Taux d'occupation (%)")
+        ax_price.plot(period, series['median_price'], label='Prix médian')
+        ax_price.plot(period, series['median_adjusted_price'], label='Prix ajusté médian')
+        ax_price.set_ylabel('Prix')
+        ax_price.set_xlabel('Date')
+        ax_price.legend()
+        fig.suptitle(f"Occupation et prix à {city}")
+    params = [city, neighbourhood, freq, series_version]
+    st.image(chart_cache.png_chart('occupancy_series', params, build, figsize=(10, 8), nrows=2))
+
+@fragment
 def plot_price_distribution_by_room_type(df):
     st.subheader("Distribution des prix par type de logement")
 
@@ -102,16 +163,16 @@ def plot_price_distribution_by_room_type(df):
     selected_room_types = st.multiselect('Sélectionner deux types de logement à comparer:', df['room_type'].unique())
 
     # Filtrer les données en fonction des types de logement sélectionnés
-    filtered_df = df[df['room_type'].isin(selected_room_types)]
+    filtered_df = drop_unused_categories(df[df['room_type'].isin(selected_room_types)])
 
     # Tracer le graphique de la distribution des prix
-    fig, ax = plt.subplots(figsize=(10, 6))
-    sns.boxplot(x='room_type', y='price', data=filtered_df, ax=ax)
-    ax.set_title('Distribution des prix par type de logement')
-    ax.set_xlabel('Type')
-    ax.set_ylabel('Prix')
-    ax.set_ylim(0, 500)
-    st.pyplot(fig)
+    def build(fig, ax):
+        sns.boxplot(x='room_type', y='price', data=filtered_df, ax=ax)
+        ax.set_title('Distribution des prix par type de logement')
+        ax.set_xlabel('Type')
+        ax.set_ylabel('Prix')
+        ax.set_ylim(0, 500)
+    st.image(chart_cache.png_chart('room_type_prices', selected_room_types, build))
     st.write("""
         Les boxplots décrivent la distribution des prix par type de logement, révélant des différences substantielles dans les gammes de prix. Les appartements et maisons entiers présentent une grande variété de prix, tandis que les chambres partagées sont les moins chères mais aussi les moins variées en termes de prix. Cela indique que malgré la préférence pour des logements entiers, il existe un marché pour tous les types de logements, chacun attirant un segment différent de voyageurs.
         """)
@@ -119,16 +180,16 @@ def plot_price_distribution_by_room_type(df):
 # Affichage du prix moyen et de la note moyenne par Superhôte vs. Hôte
 def plot_superhost_impact_on_price_and_ratings(df):
     st.subheader("Prix moyen et Note Moyenne: Superhôte vs. Hôte")
-    fig, axs = plt.subplots(1, 2, figsize=(12, 5))
-    sns.barplot(x='host_is_superhost', y='price', data=df, ax=axs[0])
-    axs[0].set_title('Prix moyen : Superhôte vs. Hôte')
-    axs[0].set_xlabel('Est Super Hôte')
-    axs[0].set_ylabel('Prix Moyen')
-    sns.barplot(x='host_is_superhost', y='review_scores_rating', data=df, ax=axs[1])
-    axs[1].set_title('Note Moyenne: Superhôte vs. Hôte')
-    axs[1].set_xlabel('Est Super Hôte')
-    axs[1].set_ylabel('Note Moyenne')
-    st.pyplot(fig)
+    def build(fig, axs):
+        sns.barplot(x='host_is_superhost', y='price', data=df, ax=axs[0])
+        axs[0].set_title('Prix moyen : Superhôte vs. Hôte')
+        axs[0].set_xlabel('Est Super Hôte')
+        axs[0].set_ylabel('Prix Moyen')
+        sns.barplot(x='host_is_superhost', y='review_scores_rating', data=df, ax=axs[1])
+        axs[1].set_title('Note Moyenne: Superhôte vs. Hôte')
+        axs[1].set_xlabel('Est Super Hôte')
+        axs[1].set_ylabel('Note Moyenne')
+    st.image(chart_cache.png_chart('superhost', None, build, figsize=(12, 5), ncols=2))
     st.write("""
     Ce graphe montre que les Superhôtes ont tendance à avoir à la fois des prix et des notes moyennes plus élevés. Cela souligne l'association perçue entre la qualité de l'expérience client et le coût du logement. Les voyageurs semblent reconnaître et valoriser le statut de Superhôte, qui est attribué aux hôtes offrant un service exceptionnel, et sont disposés à payer plus pour cette assurance qualité. Cette distinction est cruciale pour les hôtes aspirant à devenir Superhôtes, car elle peut justifier des tarifs plus élevés et améliorer l'occupation.
     """)
@@ -136,27 +197,41 @@ def plot_superhost_impact_on_price_and_ratings(df):
 # Affichage de la tendance mensuelle des reviews
 def plot_availability_trends(df):
     st.subheader("Tendance par mois")
-    df['last_review'] = pd.to_datetime(df['last_review'])
-    df['review_month'] = df['last_review'].dt.month
-    monthly_reviews = df.groupby('review_month').size().reset_index(name='count')
-
-    # Generate a color palette with distinct colors for each month
-    colors = sns.color_palette('husl', len(monthly_reviews))
-
-    # Plotting the bar chart with Seaborn for better styling
-    plt.figure(figsize=(10, 6))
-    sns.barplot(x='review_month', y='count', data=monthly_reviews, palette=colors)
-    plt.title('Tendance par mois')
-    plt.xlabel('Mois')
-    plt.ylabel('Nombre de reviews (pour mesurer activité)')
-    plt.xticks(range(1, 13), ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'])
-    st.pyplot()
+    monthly_reviews = df[['review_month', 'count']].sort_values('review_month')
+
+    def build(fig, ax):
+        # Generate a color palette with distinct colors for each month
+        colors = sns.color_palette('husl', len(monthly_reviews))
+
+        # Plotting the bar chart with Seaborn for better styling
+        sns.barplot(x='review_month', y='count', data=monthly_reviews, palette=colors, ax=ax)
+        ax.set_title('Tendance par mois')
+        ax.set_xlabel('Mois')
+        ax.set_ylabel('Nombre de reviews (pour mesurer activité)')
+        # Une barre par mois présent, dans l'ordre des mois
+        ax.set_xticks(range(len(monthly_reviews)))
+        ax.set_xticklabels([MONTH_LABELS[month - 1] for month in monthly_reviews['review_month']])
+    st.image(chart_cache.png_chart('review_months', None, build))
     st.write("""
         L'évolution mensuelle de la disponibilité des logements Airbnb offre un aperçu des fluctuations observées, attribuables à divers facteurs tels que les saisons touristiques, les événements locaux et les réglementations sur les locations à court terme. Par exemple, les pics de disponibilité en fin d'année correspondent probablement à la demande accrue pendant les vacances. À l'inverse, les creux peuvent résulter de périodes de faible activité touristique ou de décisions des propriétaires de ne pas louer leurs biens. Comprendre ces tendances est essentiel pour les hôtes et Airbnb, leur permettant d'ajuster leurs stratégies pour maximiser les revenus et équilibrer l'offre et la demande. Ce graphique offre également des indications précieuses pour la planification future, aidant les hôtes à optimiser leur occupation et Airbnb à identifier des opportunités de croissance.
         """)
 
 
-def interactive_rating_analysis(df):
+# Couleurs (RGB) des points selon la note
+RATING_COLORS = {
+    1: (214, 39, 40),
+    2: (255, 127, 14),
+    3: (255, 215, 0),
+    4: (100, 180, 230),
+    5: (44, 160, 44),
+}
+DEFAULT_RATING_COLOR = (128, 128, 128)
+
+# Taille des cellules de la grille d'agrégation (en degrés) selon le niveau de détail
+GRID_CELL_SIZES = {'Pays': 1.0, 'Ville': 0.1, 'Quartier': 0.01}
+
+@fragment
+def interactive_rating_analysis(cities):
     st.subheader("Analyse interactive des notes")
 
     # Options de sélection sous forme d'entiers de 1 à 5
@@ -165,143 +240,213 @@ def interactive_rating_analysis(df):
     # Sélection de la note
     note_selectionnee = st.selectbox("Sélectionnez la note:", options=options_notation, index=3)
 
-    # Filtrer les données en fonction de la note sélectionnée
-    df_filtered = df[df['review_scores_value'] == note_selectionnee]
+    # Sélection de la zone: seuls les logements à moins de N km du centre de la ville sont chargés
+    cities = cities.dropna(subset=['latitude', 'longitude']).set_index('city')
+    default_city = list(cities.index).index('Paris') if 'Paris' in cities.index else 0
+    selected_city = st.selectbox("Sélectionnez la ville:", cities.index, index=default_city)
+    radius_km = st.slider("Rayon autour du centre (km):", 1, 50, 10)
+    center_lat, center_lon = cities.loc[selected_city, ['latitude', 'longitude']]
+    df = spatial.listings_within(center_lat, center_lon, radius_km, columns=SECTION_COLUMNS['rating_map'])
 
-    # Création de la carte avec un zoom plus précis sur Paris
-    m = folium.Map(location=[48.8566, 2.3522], zoom_start=11)
-
-    # Ajout des marqueurs
-    for idx, row in df_filtered.iterrows():
-        folium.Marker(
-            [row['latitude'], row['longitude']],
-            tooltip=f"<b>Logement:</b> {row['neighborhood_overview']}<br><b>Note:</b> {row['review_scores_value']}",
-            icon=folium.Icon(color=get_marker_color(row['review_scores_value']))
-        ).add_to(m)
+    # Filtrer les données en fonction de la note sélectionnée
+    df_filtered = df[df['review_scores_value'] == note_selectionnee].copy()
+
+    # Couleurs calculées pour tous les points en une fois
+    df_filtered[['r', 'g', 'b']] = rating_colors(df_filtered['review_scores_value'])
+
+    # Couche WebGL (deck.gl) à la place d'un marqueur folium par logement
+    layer = pdk.Layer(
+        'ScatterplotLayer',
+        data=df_filtered[['latitude', 'longitude', 'neighborhood_overview', 'review_scores_value', 'r', 'g', 'b']],
+        get_position='[longitude, latitude]',
+        get_fill_color='[r, g, b, 200]',
+        get_radius=40,
+        radius_min_pixels=3,
+        pickable=True,
+    )
+
+    # Création de la carte centrée sur la ville sélectionnée
+    view_state = pdk.ViewState(latitude=center_lat, longitude=center_lon, zoom=11)
+    tooltip = {'html': "<b>Logement:</b> {neighborhood_overview}<br><b>Note:</b> {review_scores_value}"}
 
     # Affichage de la carte dans Streamlit
-    st_folium(m, width='100%', height=600)
-
-def get_marker_color(note):
-    """Retourne la couleur du marqueur en fonction de la note."""
-    if note == 1:
-        return 'red'
-    elif note == 2:
-        return 'orange'
-    elif note == 3:
-        return 'lightgray'  # Aucune option directe pour jaune dans folium.Icon, utiliser lightgray pour différencier
-    elif note == 4:
-        return 'lightblue'
-    elif note == 5:
-        return 'green'
-    else:
-        return 'gray'  # Couleur par défaut
+    st.pydeck_chart(pdk.Deck(layers=[layer], initial_view_state=view_state, tooltip=tooltip), use_container_width=True)
+
+def rating_colors(notes):
+    """Retourne les couleurs RGB (une ligne par note), calculées sans boucle Python."""
+    notes = np.asarray(notes, dtype=float)
+    palette = np.array([DEFAULT_RATING_COLOR] + list(RATING_COLORS.values()), dtype=np.uint8)
+    index = np.searchsorted(list(RATING_COLORS), notes) + 1
+    known = np.isin(notes, list(RATING_COLORS))
+    return palette[np.where(known, index, 0)]
+
+def price_colors(prices, low=5, high=95):
+    """Retourne les couleurs RGBA (vert -> rouge) des prix bornés aux percentiles donnés."""
+    prices = np.asarray(prices, dtype=float)
+    min_price, max_price = np.nanpercentile(prices, [low, high])
+    norm = colors.Normalize(vmin=min_price, vmax=max_price)
+    colormap = colors.LinearSegmentedColormap.from_list("price_colormap", ["green", "red"])
+    return colormap(norm(np.clip(prices, min_price, max_price)), bytes=True)
+
+def bin_listings(df, cell_size):
+    """Agrège les logements par cellule de grille: la carte reçoit une ligne par cellule."""
+    latitude = df['latitude'].to_numpy()
+    longitude = df['longitude'].to_numpy()
+    cells = pd.DataFrame({
+        'lat_cell': np.floor(latitude / cell_size),
+        'lon_cell': np.floor(longitude / cell_size),
+        'latitude': latitude,
+        'longitude': longitude,
+        'price': df['price'].to_numpy(),
+    })
+    return cells.groupby(['lat_cell', 'lon_cell']).agg(
+        latitude=('latitude', 'mean'),
+        longitude=('longitude', 'mean'),
+        price=('price', 'mean'),
+        listings=('price', 'size'),
+    ).reset_index(drop=True)
 
 # Affichage du Cluster Map des prix
+@fragment
 def plot_price_map_clustered(df):
     st.subheader("Cluster Map des prix")
     europe_center_lat, europe_center_lon = 54.5260, 15.2551
-    map = folium.Map(location=[europe_center_lat, europe_center_lon], zoom_start=4)
-    marker_cluster = MarkerCluster().add_to(map)
-    min_price = np.percentile(df['price'], 5)
-    max_price = np.percentile(df['price'], 95)
-    norm = colors.Normalize(vmin=min_price, vmax=max_price)
-    colormap = colors.LinearSegmentedColormap.from_list("price_colormap", ["green", "red"])
-    for _, row in df.iterrows():
-        clipped_price = np.clip(row['price'], min_price, max_price)
-        normalized_price = norm(clipped_price)
-        color = colors.to_hex(colormap(normalized_price))
-        folium.CircleMarker(location=[row['latitude'], row['longitude']], radius=5, color=color, fill=True, fill_color=color, fill_opacity=0.7).add_to(marker_cluster)
-    st_folium(map, width='100%', height=600)
+
+    # Regroupement côté serveur: la taille de la page dépend du nombre de cellules, pas de logements
+    detail = st.select_slider("Niveau de détail:", options=list(GRID_CELL_SIZES), value='Ville')
+    cell_size = GRID_CELL_SIZES[detail]
+    binned = bin_listings(df.dropna(subset=['latitude', 'longitude', 'price']), cell_size)
+    binned[['r', 'g', 'b', 'a']] = price_colors(binned['price'])
+    binned['radius'] = cell_size * 111_000 / 2 * np.sqrt(binned['listings'] / binned['listings'].max())
+    binned['price'] = binned['price'].round(2)
+
+    layer = pdk.Layer(
+        'ScatterplotLayer',
+        data=binned,
+        get_position='[longitude, latitude]',
+        get_fill_color='[r, g, b, 180]',
+        get_radius='radius',
+        radius_min_pixels=2,
+        pickable=True,
+    )
+    view_state = pdk.ViewState(latitude=europe_center_lat, longitude=europe_center_lon, zoom=4)
+    tooltip = {'html': "<b>Logements:</b> {listings}<br><b>Prix moyen:</b> {price}"}
+    st.pydeck_chart(pdk.Deck(layers=[layer], initial_view_state=view_state, tooltip=tooltip), use_container_width=True)
     st.write("""
         Enfin, la cluster map des prix présente une perspective géographique sur la tarification des logements Airbnb. Les clusters de couleur sur la carte indiquent des concentrations de prix similaires. Cette vue permet aux utilisateurs de déterminer rapidement où les logements sont généralement plus coûteux ou plus abordables. Par exemple, des clusters de prix élevés dans les capitales ou les destinations touristiques majeures ne sont pas surprenants. En revanche, des clusters de prix bas pourraient indiquer des marchés moins connus ou émergents. Pour les analystes de données et les décideurs chez Airbnb, cette carte peut être utilisée pour identifier des opportunités de croissance ou pour ajuster les stratégies de tarification en fonction des conditions du marché local.
         """)
 
 
-def main():
-    st.set_page_config(layout="wide")
-    st.set_option('deprecation.showPyplotGlobalUse', False)
-    st.title("Tableau de bord des données Airbnb")
-
-    # Chargement des données
-    df = load_data()
-
-    # Affichage des sections
-    st.header("Analyse des données Airbnb")
-
+# Sections 1 à 8 : graphiques issus des tables agrégées et du cache de graphiques
+def show_overview():
     # Organiser les sections en colonnes
     col1, col2 = st.columns([1, 1])
 
     # Section 1: Carte avec heatmap
     with col1:
-        heatmap_data = prepare_heatmap_data(df)
+        heatmap_data = prepare_heatmap_data(data_access.load_aggregate('agg_neighbourhood_room_type_price'))
         create_heatmap(heatmap_data)
 
     # Section 2: Treemap des villes avec les prix moyens des logements
     with col2:
-        plot_city_treemap(df)
+        plot_city_treemap(data_access.load_aggregate('agg_city_price'))
 
     # Section 3: Prix moyens par pays
     with col1:
-        plot_bar_chart(df)
+        plot_bar_chart(data_access.load_aggregate('agg_country_price'))
 
     # Section 4: Disponibilité moyenne des annonces au fil du temps
     with col2:
-        plot_availability_over_time(df)
+        plot_availability_over_time(data_access.load_aggregate('agg_availability_by_date'))
 
     # Section 5: Répartition des types de logements
     with col1:
-        plot_property_types_pie(df)
+        plot_property_types_pie(load_data('property_types'))
 
     # Section 6: Distribution des prix par type de logement
     with col2:
-        plot_price_distribution_by_room_type(df)
+        plot_price_distribution_by_room_type(load_data('room_type_prices'))
 
     # Section 7: Impact des Superhôtes sur le prix et les notes
     with col1:
-        plot_superhost_impact_on_price_and_ratings(df)
+        plot_superhost_impact_on_price_and_ratings(load_data('superhost'))
 
     # Section 8: Tendance par mois
     with col2:
-        plot_availability_trends(df)
+        plot_availability_trends(data_access.load_aggregate('agg_review_months'))
 
-    # Section 9: Analyse interactive des notes
-    interactive_rating_analysis(df)
+def confidence_intervals(groups, z=1.96):
+    """Demi-largeur de l'intervalle de confiance des prix moyens (approximation normale, sans bootstrap).
 
-    # Section 10: Analyse interactive des notes Airbnb par Pays et Quartier
+    NaN pour les groupes de moins de deux logements, dont la variance n'est pas définie.
+    """
+    n = groups['listings'].where(groups['listings'] >= 2)
+    variance = groups['price_sq_dev'] / (n - 1)
+    return z * np.sqrt(variance / n)
+
+# Les widgets de cette section ne relancent que ce fragment
+@fragment
+def plot_neighbourhood_prices():
     st.subheader('Analyse interactive des notes Airbnb par Pays et Quartier')
 
+    # Moyennes et effectifs précalculés par (pays, quartier) : aucun logement n'est chargé
+    groups = data_access.load_aggregate('agg_country_neighbourhood_price')
+
     # Sélection du pays dans la barre latérale
-    selected_country = st.selectbox('Sélectionnez le pays:', df['country'].unique())
+    selected_country = st.selectbox('Sélectionnez le pays:', groups['country'].unique())
 
     # Filtrage des données pour le pays sélectionné
-    df_filtered_country = df[df['country'] == selected_country]
+    country_groups = groups[groups['country'] == selected_country]
 
     # Sélection du quartier basé sur le pays sélectionné
     selected_neighbourhood = st.multiselect('Sélectionnez le quartier:',
-                                            df_filtered_country['neighbourhood_cleansed'].unique())
+                                            country_groups['neighbourhood_cleansed'].unique())
     # Filtrage final des données
     if selected_neighbourhood:
-        df_final_filtered = df_filtered_country[
-            df_filtered_country['neighbourhood_cleansed'].isin(selected_neighbourhood)]
-    else:
-        df_final_filtered = df_filtered_country
-
-    # Fonction pour générer et afficher un graphique
-    def plot_data(x, y, data, title, xlabel, ylabel):
-        plt.figure(figsize=(10, 6))
-        sns.barplot(x=x, y=y, data=data)
-        plt.title(title)
-        plt.xlabel(xlabel)
-        plt.ylabel(ylabel)
-        plt.xticks(rotation=90)
-        st.pyplot(plt.gcf())
+        country_groups = country_groups[country_groups['neighbourhood_cleansed'].isin(selected_neighbourhood)]
+
+    show_ci = st.checkbox("Afficher l'intervalle de confiance à 95 %", value=False)
+    data = drop_unused_categories(country_groups).sort_values('neighbourhood_cleansed')
 
     # Analyse des prix moyens par quartier
-    plot_data('neighbourhood_cleansed', 'price', df_final_filtered, 'Prix Moyen par Quartier', 'Quartier', 'Prix Moyen')
+    def build(fig, ax):
+        sns.barplot(x='neighbourhood_cleansed', y='price', data=data, errorbar=None, ax=ax)
+        if show_ci:
+            # Pas de barre d'erreur pour les quartiers d'un seul logement
+            ci = confidence_intervals(data)
+            shown = ci.notna().to_numpy()
+            ax.errorbar(np.flatnonzero(shown), data['price'][shown], yerr=ci[shown], fmt='none', ecolor='black')
+        ax.set_title('Prix Moyen par Quartier')
+        ax.set_xlabel('Quartier')
+        ax.set_ylabel('Prix Moyen')
+        ax.tick_params(axis='x', rotation=90)
+    params = [selected_country, selected_neighbourhood, show_ci]
+    st.image(chart_cache.png_chart('neighbourhood_prices', params, build))
+
+def main():
+    st.set_page_config(layout="wide")
+    st.title("Tableau de bord des données Airbnb")
 
-    # Section 10: Cluster Map des prix
-    plot_price_map_clustered(df)
+    # Affichage des sections
+    st.header("Analyse des données Airbnb")
+
+    # Seul le groupe de sections choisi est calculé (contrairement à st.tabs, qui exécute tous les onglets)
+    group = st.radio("Afficher :", SECTION_GROUPS, horizontal=True, key='section_group')
+
+    if group == OVERVIEW:
+        show_overview()
+
+    # Section 9: Analyse interactive des notes
+    elif group == RATING_MAP:
+        interactive_rating_analysis(data_access.load_aggregate('agg_city_price'))
+
+    # Section 10: Analyse interactive des notes Airbnb par Pays et Quartier
+    elif group == NEIGHBOURHOOD_PRICES:
+        plot_neighbourhood_prices()
+
+    # Section 11: Cluster Map des prix
+    else:
+        plot_price_map_clustered(load_data('price_map'))
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,374 @@
+"""Benchmarks for the ingest, aggregation, map, clustering and rendering paths.
+
+Synthetic Airbnb-shaped city CSVs are generated in a working directory
+(10k to 10M listings), then each step is timed with its peak Python memory
+(tracemalloc) and the results are written as JSON. Given a baseline file
+from an earlier run, steps that got slower or use more memory beyond the
+tolerance are reported and the exit status is 1, as when a step falls
+below its rows per second target (THROUGHPUT_TARGETS).
+
+    python benchmark.py --rows 100000 --output bench.json
+    python benchmark.py --rows 100000 --baseline bench.json
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Les modules du projet restent importables une fois dans le répertoire de travail
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Ville -> (valeur de 'neighbourhood' dans les CSV d'Airbnb, latitude, longitude)
+CITIES = {
+    'paris': ('Paris, Île-de-France, France', 48.8566, 2.3522),
+    'london': ('London, England, United Kingdom', 51.5072, -0.1276),
+    'milan': ('Milano, Lombardia, Italy', 45.4642, 9.19),
+    'amsterdam': ('Amsterdam, North Holland, Netherlands', 52.3676, 4.9041),
+    'barcelona': ('Barcelona, Catalonia, Spain', 41.3874, 2.1686),
+}
+NEIGHBOURHOODS = [f'Quartier {i}' for i in range(40)]
+PROPERTY_TYPES = ['Entire rental unit', 'Private room in rental unit', 'Entire condo', 'Entire loft',
+                  'Private room in home', 'Entire serviced apartment', 'Room in hotel']
+ROOM_TYPES = ['Entire home/apt', 'Private room', 'Shared room', 'Hotel room']
+
+# Lignes générées par écriture CSV : la mémoire reste bornée même pour 10M de logements
+GENERATE_CHUNK = 500_000
+# Identifiants des avis, disjoints de ceux des logements comme dans les fichiers d'Airbnb
+REVIEW_ID_OFFSET = 10 ** 12
+
+# Écarts absolus en dessous desquels une différence est considérée comme du bruit de mesure
+NOISE_FLOOR = {'seconds': 0.01, 'peak_mb': 1.0}
+
+# Débit minimal (lignes par seconde) des étapes qui traitent un nombre connu de lignes
+THROUGHPUT_TARGETS = {'ingest.clean_data': 250_000}
+# En dessous, le coût fixe domine et le débit n'est pas significatif
+THROUGHPUT_MIN_ROWS = 50_000
+
+
+def listings_chunk(rng, city, first_id, n):
+    neighbourhood, lat, lon = CITIES[city]
+    ids = np.arange(first_id, first_id + n)
+    prices = rng.lognormal(4.8, 0.7, n).round()
+    last_review = pd.Timestamp('2023-01-01') + pd.to_timedelta(rng.integers(0, 365, n), unit='D')
+    return pd.DataFrame({
+        'id': ids,
+        'listing_url': [f'https://www.airbnb.com/rooms/{i}' for i in ids],
+        'scrape_id': 20231212,
+        'last_scraped': '2023-12-12',
+        'name': [f'Logement {i}' for i in ids],
+        'description': 'Appartement lumineux',
+        'neighborhood_overview': rng.choice(['Calme', 'Animé', 'Central', None], n),
+        'picture_url': 'https://a0.muscache.com/pictures/x.jpg',
+        'host_id': rng.integers(1, max(n // 3, 2), n),
+        'host_since': '2016-05-01',
+        'host_is_superhost': rng.choice(['t', 'f'], n, p=[0.2, 0.8]),
+        'neighbourhood': neighbourhood,
+        'neighbourhood_cleansed': rng.choice(NEIGHBOURHOODS, n),
+        'latitude': lat + rng.normal(0, 0.04, n),
+        'longitude': lon + rng.normal(0, 0.06, n),
+        'property_type': rng.choice(PROPERTY_TYPES, n),
+        'room_type': rng.choice(ROOM_TYPES, n, p=[0.7, 0.25, 0.03, 0.02]),
+        'accommodates': rng.integers(1, 9, n),
+        'beds': rng.integers(1, 5, n).astype(float),
+        'amenities': '["Wifi", "Kitchen"]',
+        'price': [f'${p:,.2f}' for p in prices],
+        'minimum_nights': rng.integers(1, 8, n),
+        'maximum_nights': 365,
+        'availability_365': rng.integers(0, 366, n),
+        'calendar_last_scraped': '2023-12-12',
+        'number_of_reviews': rng.integers(0, 300, n),
+        'first_review': '2019-06-01',
+        'last_review': last_review.strftime('%Y-%m-%d'),
+        'review_scores_rating': rng.uniform(3, 5, n).round(2),
+        'review_scores_value': rng.integers(1, 6, n).astype(float),
+        'license': None,
+    })
+
+
+def reviews_chunk(rng, ids, first_review_id, per_listing):
+    """Reviews of the listings ``ids``, with the columns of Airbnb's reviews.csv.
+
+    As in the real files, ``listing_id`` is the reviewed listing and ``id``
+    the review's own id, distinct from every listing id. The non-streaming
+    ingest (read_city) merges listings and reviews on ``id``, so there, as
+    with real data, reviews do not join; the streaming ingest counts them
+    per ``listing_id``.
+    """
+    n = len(ids) * per_listing
+    return pd.DataFrame({
+        'listing_id': rng.choice(ids, n),
+        'id': np.arange(first_review_id, first_review_id + n),
+        'date': '2023-05-01',
+        'reviewer_id': rng.integers(1, 10 ** 6, n),
+        'reviewer_name': 'Voyageur',
+        'comments': 'Très bien situé',
+    })
+
+
+def generate_dataset(base_path, rows, n_cities=3, reviews_per_listing=2, seed=0):
+    """Write ``rows`` listings spread over ``n_cities`` cities as Airbnb-shaped CSVs."""
+    rng = np.random.default_rng(seed)
+    cities = list(CITIES)[:n_cities]
+    next_id, next_review_id = 1, REVIEW_ID_OFFSET
+    for index, city in enumerate(cities):
+        city_rows = rows // n_cities + (1 if index < rows % n_cities else 0)
+        city_path = os.path.join(base_path, city)
+        os.makedirs(city_path, exist_ok=True)
+        written = 0
+        while written < city_rows:
+            n = min(GENERATE_CHUNK, city_rows - written)
+            listings = listings_chunk(rng, city, next_id, n)
+            reviews = reviews_chunk(rng, listings['id'].to_numpy(), next_review_id, reviews_per_listing)
+            mode, header = ('w', True) if written == 0 else ('a', False)
+            listings.to_csv(os.path.join(city_path, 'listings.csv'), index=False, mode=mode, header=header)
+            reviews.to_csv(os.path.join(city_path, 'reviews.csv'), index=False, mode=mode, header=header)
+            written += n
+            next_id += n
+            next_review_id += len(reviews)
+    return [os.path.join(base_path, city) for city in cities]
+
+
+def read_json(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def measure(func, repeat=3, memory=True):
+    """Best wall time over ``repeat`` runs, plus the peak traced memory of one extra run."""
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        runs.append(time.perf_counter() - start)
+    result = {'seconds': min(runs), 'runs': runs}
+    if memory:
+        # Run séparé : tracemalloc ralentit le code mesuré
+        tracemalloc.start()
+        try:
+            func()
+            result['peak_mb'] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        finally:
+            tracemalloc.stop()
+    return result
+
+
+def benchmarks(base_path):
+    """Yield (name, function) pairs; each name prefix is a group selectable with --only."""
+    # Import après le chdir : les modules lisent la base par un chemin relatif
+    import app
+    import chart_cache
+    import data_access
+    import ml_models
+    import mlapp
+    import prepare_data
+    import recommender
+    import seaborn as sns
+    import spatial
+    from aggregates import AGGREGATES, materialize_aggregates
+
+    first_city = prepare_data.list_city_paths(base_path)[0]
+    raw = pd.merge(pd.read_csv(os.path.join(first_city, 'listings.csv')),
+                   pd.read_csv(os.path.join(first_city, 'reviews.csv')), on='id', how='left')
+    def clean():
+        return prepare_data.clean_data(raw.copy())
+    clean.rows = len(raw)
+    yield 'ingest.clean_data', clean
+    yield 'ingest.merge_and_insert_data', lambda: prepare_data.merge_and_insert_data(base_path)
+    yield 'ingest.merge_and_insert_data_streaming', lambda: prepare_data.merge_and_insert_data(
+        base_path, streaming=True)
+
+    def materialize():
+        with data_access.get_writer().begin() as conn:
+            materialize_aggregates(conn)
+    yield 'aggregate.materialize', materialize
+
+    def cold(func, *args):
+        def run():
+            data_access.clear_cache()
+            return func(*args)
+        return run
+    for name in AGGREGATES:
+        yield f'aggregate.load.{name}', cold(data_access.load_aggregate, name)
+    all_columns = sorted({col for columns in app.SECTION_COLUMNS.values() for col in columns})
+    yield 'aggregate.load_columns', cold(data_access.load_columns, all_columns)
+    heatmap_source = data_access.load_aggregate('agg_neighbourhood_room_type_price')
+    yield 'aggregate.heatmap_pivot', lambda: app.prepare_heatmap_data(heatmap_source)
+
+    price_map = data_access.load_columns(app.SECTION_COLUMNS['price_map']).dropna()
+    for level, cell_size in app.GRID_CELL_SIZES.items():
+        yield f'map.bin_listings.{level}', lambda cell_size=cell_size: app.bin_listings(price_map, cell_size)
+    yield 'map.price_colors', lambda: app.price_colors(price_map['price'])
+    ratings = data_access.load_columns(['review_scores_value'])['review_scores_value']
+    yield 'map.rating_colors', lambda: app.rating_colors(ratings)
+    _, lat, lon = CITIES[os.path.basename(first_city)]
+    yield 'map.listings_within', lambda: spatial.listings_within(
+        lat, lon, 10, columns=app.SECTION_COLUMNS['rating_map'])
+
+    # Plus grande tranche (pays, type de chambre), celle que le recommandeur met le plus de temps à traiter
+    data = recommender.load_data()
+    country, room_type = data.groupby(['country', 'room_type'], observed=True).size().idxmax()
+    data = recommender.select_slice(data, country, room_type)
+    features = recommender.CLUSTER_FEATURES
+    yield 'ml.perform_clustering', lambda: mlapp.perform_clustering(data.copy(), features)
+    kmeans, scaler = mlapp.perform_clustering(data.copy(), features)
+    user_input = [data[feature].median() for feature in features]
+
+    def nearest_cluster_x100():
+        for _ in range(100):
+            recommender.find_nearest_cluster(kmeans, user_input, scaler, features)
+    yield 'ml.find_nearest_cluster_x100', nearest_cluster_x100
+
+    model = ml_models.fit_cluster_model(data, features)
+    cluster = int(recommender.find_nearest_cluster(model.kmeans, user_input, model.scaler, features))
+    candidates = model.candidates(cluster, user_input[0], recommender.RERANK_CANDIDATES)
+
+    def rerank_x100():
+        for _ in range(100):
+            recommender.rerank(*candidates, user_input[0])
+    yield 'ml.rerank_x100', rerank_x100
+
+    heatmap = app.prepare_heatmap_data(heatmap_source)
+    yield 'render.heatmap', lambda: chart_cache.render_png(
+        lambda fig, ax: sns.heatmap(heatmap, cmap='YlGnBu', ax=ax), figsize=(12, 8))
+    superhost = data_access.load_columns(app.SECTION_COLUMNS['superhost'])
+
+    def superhost_barplots(fig, axs):
+        # Barplots avec l'intervalle de confiance bootstrap par défaut de seaborn
+        sns.barplot(x='host_is_superhost', y='price', data=superhost, ax=axs[0])
+        sns.barplot(x='host_is_superhost', y='review_scores_rating', data=superhost, ax=axs[1])
+    yield 'render.superhost', lambda: chart_cache.render_png(superhost_barplots, figsize=(12, 5), ncols=2)
+
+
+def run_benchmarks(workdir, rows, n_cities=3, reviews_per_listing=2, repeat=3, memory=True, only=None):
+    workdir = os.path.abspath(workdir)
+    base_path = os.path.join(workdir, 'ml')
+    marker = os.path.join(workdir, 'dataset.json')
+    dataset = {'rows': rows, 'cities': n_cities, 'reviews_per_listing': reviews_per_listing}
+    # Les CSV déjà générés avec les mêmes paramètres sont réutilisés
+    if not os.path.exists(marker) or read_json(marker) != dataset:
+        start = time.perf_counter()
+        generate_dataset(base_path, rows, n_cities, reviews_per_listing)
+        with open(marker, 'w') as f:
+            json.dump(dataset, f)
+        logger.info("Generated %d listings in %.2fs", rows, time.perf_counter() - start)
+
+    os.chdir(workdir)
+    # Base Django de travail, migrée comme celle du projet : les notes du recommandeur y sont lues.
+    # La variable doit être posée avant l'import de ratings, qui la lit au chargement
+    os.environ['DATAML_RATINGS_DB'] = os.path.join(workdir, 'db.sqlite3')
+    subprocess.run([sys.executable, os.path.join(PROJECT_DIR, 'manage.py'), 'migrate', '--verbosity', '0'],
+                   check=True)
+    if PROJECT_DIR not in sys.path:
+        sys.path.insert(0, PROJECT_DIR)
+    import prepare_data
+    # Base initiale pour les étapes qui lisent merged_data
+    prepare_data.merge_and_insert_data(base_path, streaming=True)
+
+    results = {}
+    for name, func in benchmarks(base_path):
+        if only and not any(name.startswith(prefix) for prefix in only):
+            continue
+        results[name] = measure(func, repeat, memory)
+        if hasattr(func, 'rows'):
+            results[name]['rows'] = func.rows
+            results[name]['rows_per_second'] = func.rows / results[name]['seconds']
+        logger.info("%-50s %8.3fs %10s", name, results[name]['seconds'],
+                    f"{results[name]['peak_mb']:.1f} MB" if 'peak_mb' in results[name] else '')
+    return {
+        'dataset': dataset,
+        'environment': {
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+        },
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'results': results,
+    }
+
+
+def compare(report, baseline, tolerance):
+    """Return the (name, metric, baseline, current) tuples that regressed by more than ``tolerance``."""
+    if baseline.get('dataset') != report['dataset']:
+        logger.warning("Baseline dataset %s differs from %s: comparison is not meaningful",
+                       baseline.get('dataset'), report['dataset'])
+    regressions = []
+    for name, result in report['results'].items():
+        previous = baseline.get('results', {}).get(name)
+        if previous is None:
+            continue
+        for metric, floor in NOISE_FLOOR.items():
+            if metric not in result or not previous.get(metric):
+                continue
+            if result[metric] > previous[metric] * (1 + tolerance) and result[metric] - previous[metric] > floor:
+                regressions.append((name, metric, previous[metric], result[metric]))
+    return regressions
+
+
+def check_throughput(report, targets=THROUGHPUT_TARGETS):
+    """Return the (name, target, measured) tuples below their rows per second target."""
+    slow = []
+    for name, target in targets.items():
+        result = report['results'].get(name)
+        if result is None or result['rows'] < THROUGHPUT_MIN_ROWS:
+            continue
+        if result['rows_per_second'] < target:
+            slow.append((name, target, result['rows_per_second']))
+    return slow
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the data pipeline and the dashboards on synthetic data")
+    parser.add_argument('--rows', type=int, default=10_000, help="number of listings to generate (10k to 10M)")
+    parser.add_argument('--cities', type=int, default=3, choices=range(1, len(CITIES) + 1))
+    parser.add_argument('--reviews-per-listing', type=int, default=2)
+    parser.add_argument('--repeat', type=int, default=3, help="timed runs per step (the best one is kept)")
+    parser.add_argument('--no-memory', action='store_true', help="skip the extra run measuring peak memory")
+    parser.add_argument('--only', nargs='+', help="step name prefixes to run, e.g. ingest ml.perform_clustering")
+    parser.add_argument('--workdir', help="directory for the generated data and databases (default: temporary)")
+    parser.add_argument('--output', help="JSON file for the results (default: standard output)")
+    parser.add_argument('--baseline', help="JSON results of an earlier run to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="allowed slowdown or memory growth (0.25 = 25%%)")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    args = parse_args()
+    workdir = args.workdir or tempfile.mkdtemp(prefix='dataml-bench-')
+    os.makedirs(workdir, exist_ok=True)
+    report = run_benchmarks(workdir, args.rows, args.cities, args.reviews_per_listing, args.repeat,
+                            memory=not args.no_memory, only=args.only)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    slow = check_throughput(report)
+    for name, target, measured in slow:
+        logger.error("Below target: %s %.0f rows/s (target %.0f rows/s)", name, measured, target)
+
+    if args.baseline:
+        regressions = compare(report, read_json(args.baseline), args.tolerance)
+        for name, metric, previous, current in regressions:
+            logger.error("Regression: %s %s %.3f -> %.3f", name, metric, previous, current)
+        if regressions:
+            sys.exit(1)
+        logger.info("No regression against %s", args.baseline)
+    if slow:
+        sys.exit(1)
@@ -0,0 +1,185 @@
+"""Occupancy and price time series computed from the Calendar table.
+
+The Calendar rows (loaded by ``manage.py load_calendar`` into the Django
+database) are joined to merged_data on the listing id to get the city and
+neighbourhood, then summarized per day and per month into tables of
+airbnb_data.db that the dashboard reads with indexed range queries.
+
+Updates are incremental: only the periods from the first month touched by
+the calendar rows added since the last run are recomputed. When a listing
+and date appear in several snapshots, the most recently loaded row wins.
+"""
+import argparse
+import logging
+import time
+
+import pandas as pd
+
+import data_access
+from db import create_connection
+
+logger = logging.getLogger(__name__)
+
+CALENDAR_TABLE = 'DataMLApp_calendar'
+
+SERIES_TABLES = {
+    'daily': 'ts_calendar_daily',
+    'monthly': 'ts_calendar_monthly',
+}
+
+# Dernière ligne du calendrier prise en compte et version des annonces utilisée pour la jointure
+LAST_ROWID_KEY = 'calendar_series_rowid'
+VERSION_KEY = 'calendar_series_version'
+# Estampille changée à chaque mise à jour des tables, qui invalide les graphiques des séries
+UPDATED_KEY = 'calendar_series_updated'
+
+
+def read_calendar_rows(calendar_conn, since=None):
+    query = f"SELECT id, listing_id, date, available, price, adjusted_price FROM {CALENDAR_TABLE}"
+    params = ()
+    if since is not None:
+        query += " WHERE date >= ?"
+        params = (since,)
+    rows = pd.read_sql_query(query, calendar_conn, params=params)
+    # Une date déjà présente dans un snapshot précédent est remplacée par la plus récente
+    rows = rows.sort_values('id').drop_duplicates(['listing_id', 'date'], keep='last')
+    rows['booked'] = (rows['available'] == 'f').astype(int)
+    for column in ('price', 'adjusted_price'):
+        rows[column] = pd.to_numeric(rows[column], errors='coerce')
+    return rows.drop(columns=['id', 'available'])
+
+
+def listing_locations():
+    locations = data_access.load_columns(['id', 'city', 'neighbourhood_cleansed'])
+    return locations.dropna(subset=['id', 'city']).drop_duplicates('id').rename(columns={'id': 'listing_id'})
+
+
+def summarize(rows, period):
+    """Occupancy rate and median prices per city (neighbourhood NULL) and per neighbourhood."""
+    rows = rows.assign(period=period)
+    frames = []
+    for keys in (['city', 'period'], ['city', 'neighbourhood_cleansed', 'period']):
+        grouped = rows.dropna(subset=keys).groupby(keys, sort=False, observed=True).agg(
+            listing_nights=('listing_id', 'size'),
+            booked_nights=('booked', 'sum'),
+            median_price=('price', 'median'),
+            median_adjusted_price=('adjusted_price', 'median'),
+        ).reset_index()
+        frames.append(grouped)
+    series = pd.concat(frames, ignore_index=True)
+    series['occupancy_rate'] = series['booked_nights'] / series['listing_nights']
+    return series[['city', 'neighbourhood_cleansed', 'period', 'listing_nights', 'booked_nights',
+                   'occupancy_rate', 'median_price', 'median_adjusted_price']]
+
+
+def update_calendar_series(calendar_db, rebuild=False):
+    """Bring the series tables up to date with the Calendar table of ``calendar_db``.
+
+    A full rebuild happens on request, on the first run, and when
+    merged_data was re-ingested since the previous run (the city and
+    neighbourhood of a listing may have changed). Returns the number of
+    calendar rows read.
+    """
+    start = time.perf_counter()
+    data_version = data_access.get_data_version()
+    engine = data_access.get_writer()
+    with engine.connect() as conn:
+        last_rowid = data_access.read_metadata(conn, LAST_ROWID_KEY)
+        series_version = data_access.read_metadata(conn, VERSION_KEY)
+        tables_exist = all(data_access.table_exists(conn, table) for table in SERIES_TABLES.values())
+    rebuild = rebuild or last_rowid is None or series_version != data_version or not tables_exist
+
+    calendar_conn = create_connection(calendar_db, readonly=True)
+    try:
+        max_rowid = calendar_conn.execute(f"SELECT MAX(id) FROM {CALENDAR_TABLE}").fetchone()[0] or 0
+        since = None
+        if not rebuild:
+            if max_rowid <= int(last_rowid):
+                return 0
+            first_date = calendar_conn.execute(
+                f"SELECT MIN(date) FROM {CALENDAR_TABLE} WHERE id > ?", (int(last_rowid),)).fetchone()[0]
+            # Les mois touchés sont recalculés en entier pour que les médianes mensuelles restent exactes
+            since = first_date[:7] + '-01'
+        rows = read_calendar_rows(calendar_conn, since)
+    finally:
+        calendar_conn.close()
+
+    rows = rows.merge(listing_locations(), on='listing_id', how='inner')
+    periods = {'daily': rows['date'], 'monthly': rows['date'].str[:7]}
+
+    with engine.begin() as conn:
+        for freq, table in SERIES_TABLES.items():
+            if rebuild:
+                conn.exec_driver_sql(f"DROP TABLE IF EXISTS {table}")
+                conn.exec_driver_sql(
+                    f"""CREATE TABLE {table} (
+                        city TEXT NOT NULL, neighbourhood_cleansed TEXT, period TEXT NOT NULL,
+                        listing_nights INTEGER, booked_nights INTEGER, occupancy_rate REAL,
+                        median_price REAL, median_adjusted_price REAL)""")
+                conn.exec_driver_sql(
+                    f"CREATE INDEX idx_{table} ON {table} (city, neighbourhood_cleansed, period)")
+            else:
+                conn.exec_driver_sql(f"DELETE FROM {table} WHERE period >= ?",
+                                     (since if freq == 'daily' else since[:7],))
+            summarize(rows, periods[freq]).to_sql(table, conn, if_exists='append', index=False)
+        data_access.write_metadata(conn, LAST_ROWID_KEY, str(max_rowid))
+        data_access.write_metadata(conn, VERSION_KEY, data_version)
+        data_access.write_metadata(conn, UPDATED_KEY, str(time.time_ns()))
+
+    logger.info("Calendar series %s from %s: %d rows in %.2fs", 'rebuilt' if rebuild else 'updated',
+                since or 'the first date', len(rows), time.perf_counter() - start)
+    return len(rows)
+
+
+def load_series(city, neighbourhood=None, start=None, end=None, freq='daily'):
+    """Occupancy and prices of a city (or one of its neighbourhoods) between ``start`` and ``end``.
+
+    Periods are ISO strings: 'YYYY-MM-DD' for the daily series, 'YYYY-MM'
+    for the monthly one; both bounds are inclusive and optional.
+    """
+    table = SERIES_TABLES[freq]
+    where, params = ['city = ?', 'neighbourhood_cleansed IS ?'], [city, neighbourhood]
+    if start is not None:
+        where.append('period >= ?')
+        params.append(start)
+    if end is not None:
+        where.append('period <= ?')
+        params.append(end)
+    query = (f"SELECT period, listing_nights, booked_nights, occupancy_rate, median_price, median_adjusted_price "
+             f"FROM {table} WHERE {' AND '.join(where)} ORDER BY period")
+    return pd.read_sql_query(query, data_access.get_engine(), params=tuple(params))
+
+
+def series_version():
+    """Stamp of the last update of the series tables, or None before the first one."""
+    with data_access.get_engine().connect() as conn:
+        return data_access.read_metadata(conn, UPDATED_KEY)
+
+
+def series_cities():
+    """Cities with a calendar series, or an empty list when none has been computed yet."""
+    with data_access.get_engine().connect() as conn:
+        if not data_access.table_exists(conn, SERIES_TABLES['monthly']):
+            return []
+        return [row[0] for row in conn.exec_driver_sql(
+            f"SELECT DISTINCT city FROM {SERIES_TABLES['monthly']} ORDER BY city")]
+
+
+def series_neighbourhoods(city):
+    query = (f"SELECT DISTINCT neighbourhood_cleansed FROM {SERIES_TABLES['monthly']} "
+             "WHERE city = ? AND neighbourhood_cleansed IS NOT NULL ORDER BY neighbourhood_cleansed")
+    with data_access.get_engine().connect() as conn:
+        return [row[0] for row in conn.exec_driver_sql(query, (city,))]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Update the occupancy and price series from the Calendar table")
+    parser.add_argument('--calendar-db', default='db.sqlite3', help="database holding the Calendar table")
+    parser.add_argument('--rebuild', action='store_true', help="recompute every period")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    args = parse_args()
+    update_calendar_series(args.calendar_db, rebuild=args.rebuild)
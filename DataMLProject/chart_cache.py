@@ -0,0 +1,99 @@
+"""Process-wide cache of rendered dashboard charts.
+
+Charts are stored already rendered (PNG bytes for matplotlib, JSON for
+Plotly) under a key made of the chart id, its filter parameters and the
+data version, so every session and rerun showing the same chart reuses one
+rendering. Concurrent requests for a chart that is not cached yet wait for
+the first one instead of rendering it again. The cache is bounded in bytes
+and evicts the least recently used charts.
+"""
+import io
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from matplotlib.figure import Figure
+
+import data_access
+
+# Memory budget of the chart cache (bytes)
+CHART_CACHE_MAX_BYTES = int(os.environ.get('DATAML_CHART_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+
+_lock = threading.Lock()
+_charts = OrderedDict()
+_pending = {}
+_cache_bytes = 0
+
+
+def chart_key(chart_id, params=None):
+    # Les paramètres sont sérialisés pour servir de clé (listes, numpy, catégories...)
+    return chart_id, data_access.get_data_version(), json.dumps(params, sort_keys=True, default=str)
+
+
+def _store(key, value):
+    global _cache_bytes
+    _charts[key] = value
+    _cache_bytes += len(value)
+    while _cache_bytes > CHART_CACHE_MAX_BYTES and len(_charts) > 1:
+        _, evicted = _charts.popitem(last=False)
+        _cache_bytes -= len(evicted)
+
+
+def get_or_render(key, render):
+    """Return the cached rendering for ``key``, calling ``render()`` once if it is missing."""
+    while True:
+        with _lock:
+            if key in _charts:
+                _charts.move_to_end(key)
+                return _charts[key]
+            event = _pending.get(key)
+            owner = event is None
+            if owner:
+                event = _pending[key] = threading.Event()
+        if not owner:
+            # Un autre visiteur calcule ce graphique : on attend son résultat
+            event.wait()
+            continue
+        try:
+            value = render()
+            with _lock:
+                _store(key, value)
+            return value
+        finally:
+            with _lock:
+                del _pending[key]
+            event.set()
+
+
+def render_png(build, figsize=(10, 6), nrows=1, ncols=1):
+    """Draw a matplotlib figure with ``build(fig, axes)`` and return it as PNG bytes.
+
+    The figure is created without pyplot, so it is never registered in the
+    global figure manager, and it is cleared as soon as it is rendered.
+    """
+    fig = Figure(figsize=figsize)
+    try:
+        axes = fig.subplots(nrows, ncols)
+        build(fig, axes)
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format='png', bbox_inches='tight')
+        return buffer.getvalue()
+    finally:
+        fig.clear()
+
+
+def png_chart(chart_id, params, build, **figure_options):
+    return get_or_render(chart_key(chart_id, params), lambda: render_png(build, **figure_options))
+
+
+def plotly_chart(chart_id, params, build):
+    # Figure Plotly conservée au format JSON
+    return get_or_render(chart_key(chart_id, params), lambda: build().to_json())
+
+
+def clear():
+    global _cache_bytes
+    with _lock:
+        _charts.clear()
+        _cache_bytes = 0
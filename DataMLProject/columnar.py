@@ -0,0 +1,114 @@
+"""Columnar Parquet snapshot of merged_data.
+
+prepare_data.py writes one snapshot per data version, partitioned by
+country (``snapshots/<version>/country=<name>/``). data_access reads
+the requested columns, and optionally a single country, from memory-mapped
+files instead of materializing rows through SQLite. pyarrow is optional:
+without it, or without a snapshot for the current version, callers get None
+and fall back to SQLite.
+"""
+import logging
+import os
+import shutil
+import time
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    from pyarrow import fs
+except ImportError:
+    pa = None
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_DIR = os.environ.get('DATAML_SNAPSHOT_DIR', 'snapshots')
+TABLE_NAME = 'merged_data'
+PARTITION_COLUMN = 'country'
+
+# Types Arrow des colonnes SQLite (schéma fixe pour toutes les partitions)
+ARROW_TYPES = {
+    'INTEGER': 'int64',
+    'REAL': 'float64',
+    'TEXT': 'string',
+}
+
+
+def available():
+    return pa is not None
+
+
+def snapshot_path(version):
+    return os.path.join(SNAPSHOT_DIR, str(version))
+
+
+def _partitioning():
+    return ds.partitioning(pa.schema([(PARTITION_COLUMN, pa.string())]), flavor='hive')
+
+
+def write_snapshot(engine, version, table=TABLE_NAME):
+    """Write the Parquet snapshot of ``table`` for ``version``, one country at a time.
+
+    The snapshot is built in a temporary directory and renamed once
+    complete, so readers never see a partial one.
+    """
+    if not available():
+        logger.info("pyarrow is not installed: no Parquet snapshot written")
+        return None
+    start = time.perf_counter()
+    target = snapshot_path(version)
+    tmp = target + '.tmp'
+    shutil.rmtree(tmp, ignore_errors=True)
+
+    with engine.connect() as conn:
+        columns = [(row[1], (row[2] or 'TEXT').split()[0].upper())
+                   for row in conn.exec_driver_sql(f"PRAGMA table_info({table})")]
+        countries = [row[0] for row in conn.exec_driver_sql(f"SELECT DISTINCT {PARTITION_COLUMN} FROM {table}")]
+    arrow_schema = pa.schema([(name, ARROW_TYPES.get(sql_type, 'string')) for name, sql_type in columns])
+
+    for i, country in enumerate(countries):
+        # Lecture pays par pays : la mémoire est bornée par le plus grand pays
+        df = pd.read_sql_query(f"SELECT * FROM {table} WHERE {PARTITION_COLUMN} IS ? ORDER BY rowid",
+                               engine, params=(country,))
+        ds.write_dataset(pa.Table.from_pandas(df, schema=arrow_schema, preserve_index=False), tmp,
+                         format='parquet', partitioning=_partitioning(), basename_template=f'part-{i}-{{i}}.parquet',
+                         existing_data_behavior='overwrite_or_ignore')
+    os.makedirs(tmp, exist_ok=True)
+    shutil.rmtree(target, ignore_errors=True)
+    os.replace(tmp, target)
+    logger.info("Parquet snapshot of %d countries written to %s in %.2fs", len(countries), target,
+                time.perf_counter() - start)
+    return target
+
+
+def remove_old_snapshots(version):
+    if not os.path.isdir(SNAPSHOT_DIR):
+        return
+    for name in os.listdir(SNAPSHOT_DIR):
+        if name != str(version):
+            shutil.rmtree(os.path.join(SNAPSHOT_DIR, name), ignore_errors=True)
+
+
+def read_columns(version, columns, country=None):
+    """Read ``columns`` (of one ``country`` if given) from the snapshot of ``version``.
+
+    Rows come back in listing id order, the rowid order of SQLite, so
+    columns read here and columns read from SQLite line up. Returns None
+    when there is no usable snapshot.
+    """
+    path = snapshot_path(version)
+    if version is None or not available() or not os.path.isdir(path):
+        return None
+    read = list(dict.fromkeys(list(columns) + ['id']))
+    try:
+        dataset = ds.dataset(path, format='parquet', partitioning=_partitioning(),
+                             filesystem=fs.LocalFileSystem(use_mmap=True))
+        flt = ds.field(PARTITION_COLUMN) == country if country is not None else None
+        df = dataset.to_table(columns=read, filter=flt).to_pandas()
+    except (OSError, pa.ArrowException) as exc:
+        # Snapshot supprimé pendant la lecture (nouvelle ingestion) ou colonne absente
+        logger.warning("Parquet snapshot %s unusable, falling back to SQLite: %s", path, exc)
+        return None
+    df = df.sort_values('id', kind='stable').reset_index(drop=True)
+    return df[list(dict.fromkeys(columns))]
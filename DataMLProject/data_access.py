@@ -0,0 +1,247 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+import pandas as pd
+
+import columnar
+import db
+import schema
+from aggregates import AGGREGATES
+
+DB_PATH = 'airbnb_data.db'
+TABLE_NAME = 'merged_data'
+METADATA_TABLE = 'ingest_metadata'
+
+# Memory budget of the process-wide column cache (bytes)
+CACHE_MAX_BYTES = int(os.environ.get('DATAML_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+
+_lock = threading.RLock()
+_columns_cache = OrderedDict()
+_cache_bytes = 0
+_version_cache = {'stat': None, 'version': None}
+_aggregates_cache = {}
+# Chargements en cours, par clé de cache : les autres appels attendent leur résultat au lieu de relire
+_pending = {}
+
+
+def get_engine():
+    # Pooled read-only connections: dashboard reads never wait for an ingest
+    return db.read_engine(DB_PATH)
+
+
+def get_writer():
+    return db.write_engine(DB_PATH)
+
+
+def table_exists(conn, name):
+    return conn.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)).first() is not None
+
+
+def table_columns(conn, table):
+    return [row[1] for row in conn.exec_driver_sql(f"PRAGMA table_info({table})")]
+
+
+def read_metadata(conn, key):
+    if not table_exists(conn, METADATA_TABLE):
+        return None
+    row = conn.exec_driver_sql(f"SELECT value FROM {METADATA_TABLE} WHERE key = ?", (key,)).first()
+    return row[0] if row else None
+
+
+def write_metadata(conn, key, value):
+    conn.exec_driver_sql(
+        f"CREATE TABLE IF NOT EXISTS {METADATA_TABLE} (key TEXT PRIMARY KEY, value TEXT)")
+    conn.exec_driver_sql(
+        f"INSERT INTO {METADATA_TABLE} (key, value) VALUES (?, ?) "
+        "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+        (key, value))
+
+
+def write_data_version(engine, version=None):
+    """Write the version stamp read by the dashboards after an ingest."""
+    if version is None:
+        version = str(time.time_ns())
+    with engine.begin() as conn:
+        write_metadata(conn, 'data_version', version)
+    return version
+
+
+def get_data_version():
+    """Return the current data version.
+
+    The stamp written by prepare_data.py is only re-read when the database
+    file or its write-ahead log changes on disk; databases without a stamp
+    fall back to the file mtime.
+    """
+    try:
+        stat = os.stat(DB_PATH)
+    except FileNotFoundError:
+        return None
+    key = (stat.st_mtime_ns, stat.st_size)
+    try:
+        # En mode WAL, les écritures n'atteignent le fichier principal qu'au checkpoint
+        wal = os.stat(DB_PATH + '-wal')
+        key += (wal.st_mtime_ns, wal.st_size)
+    except FileNotFoundError:
+        pass
+    with _lock:
+        if _version_cache['stat'] == key:
+            return _version_cache['version']
+        version = _read_version_stamp() or f'mtime-{stat.st_mtime_ns}-{stat.st_size}'
+        _version_cache['stat'] = key
+        _version_cache['version'] = version
+        return version
+
+
+def data_version_timestamp(version):
+    """Return when ``version`` was produced, as an aware datetime (None if unknown)."""
+    if version is None:
+        return None
+    if version.startswith('mtime-'):
+        version = version.split('-')[1]
+    if not version.isdigit():
+        return None
+    return datetime.fromtimestamp(int(version) / 1e9, tz=timezone.utc)
+
+
+def _read_version_stamp():
+    with get_engine().connect() as conn:
+        return read_metadata(conn, 'data_version')
+
+
+def _evict(version):
+    global _cache_bytes
+    # Drop columns from older data versions first, then least recently used ones
+    for key in [k for k in _columns_cache if k[0] != version]:
+        _cache_bytes -= _columns_cache.pop(key)[1]
+    while _cache_bytes > CACHE_MAX_BYTES and len(_columns_cache) > 1:
+        _, (_, size) = _columns_cache.popitem(last=False)
+        _cache_bytes -= size
+
+
+def load_columns(columns):
+    """Load the given columns of merged_data as a DataFrame.
+
+    Columns are cached individually for the whole process and shared between
+    callers, so each chart only pays for the columns it uses and a rerun does
+    not touch the database until the data version changes. They are read
+    from the Parquet snapshot of the data version when there is one.
+    The cache lock is not held while reading, and concurrent callers missing
+    the same column wait for a single read.
+    """
+    global _cache_bytes
+    columns = list(dict.fromkeys(columns))
+    version = get_data_version()
+    # Colonnes lues par cet appel, gardées ici au cas où le cache les évincerait avant la fin
+    loaded = {}
+    while True:
+        with _lock:
+            missing = [col for col in columns if col not in loaded and (version, col) not in _columns_cache]
+            if not missing:
+                for col in columns:
+                    if (version, col) in _columns_cache:
+                        _columns_cache.move_to_end((version, col))
+                df = pd.DataFrame({col: loaded[col] if col in loaded else _columns_cache[(version, col)][0]
+                                   for col in columns})
+                _evict(version)
+                return df
+            owned = [col for col in missing if (version, col) not in _pending]
+            events = {col: _pending.setdefault((version, col), threading.Event()) for col in missing}
+        if not owned:
+            # Un autre appel lit ces colonnes : on attend son résultat
+            for col in missing:
+                events[col].wait()
+            continue
+        # Lecture hors du verrou : les autres appels servent leurs colonnes en cache pendant ce temps
+        try:
+            fetched = _read_columns(version, owned)
+            with _lock:
+                for col in owned:
+                    series = loaded[col] = fetched[col]
+                    _columns_cache[(version, col)] = (series, int(series.memory_usage(deep=True)))
+                    _cache_bytes += _columns_cache[(version, col)][1]
+        finally:
+            with _lock:
+                for col in owned:
+                    del _pending[(version, col)]
+            for col in owned:
+                events[col].set()
+
+
+def _read_columns(version, columns):
+    fetched = columnar.read_columns(version, columns)
+    if fetched is None:
+        query = f"SELECT {', '.join(schema.quote(col) for col in columns)} FROM {TABLE_NAME} ORDER BY rowid"
+        fetched = pd.read_sql_query(query, get_engine())
+    return schema.apply_dtypes(fetched)
+
+
+def load_country(columns, country):
+    """Load the given columns of the listings of one country (not cached)."""
+    columns = list(dict.fromkeys(columns))
+    df = columnar.read_columns(get_data_version(), columns, country=country)
+    if df is None:
+        query = (f"SELECT {', '.join(schema.quote(col) for col in columns)} FROM {TABLE_NAME} "
+                 "WHERE country = ? ORDER BY rowid")
+        df = pd.read_sql_query(query, get_engine(), params=(country,))
+    return schema.apply_dtypes(df)
+
+
+def load_listings(ids, columns):
+    """Fetch listings by id from merged_data, in the order of ``ids``."""
+    ids = [int(listing_id) for listing_id in ids]
+    columns = list(dict.fromkeys(['id'] + list(columns)))
+    if not ids:
+        return pd.DataFrame(columns=columns)
+    query = (f"SELECT {', '.join(schema.quote(col) for col in columns)} FROM {TABLE_NAME} "
+             f"WHERE id IN ({', '.join('?' * len(ids))})")
+    df = schema.apply_dtypes(pd.read_sql_query(query, get_engine(), params=tuple(ids)))
+    return df.drop_duplicates('id').set_index('id').reindex(ids).reset_index()
+
+
+def load_aggregate(name):
+    """Load a summary table materialized by prepare_data.py.
+
+    Databases ingested before the summary tables existed are aggregated on
+    the fly in SQL instead.
+    """
+    version = get_data_version()
+    key = ('aggregate', name, version)
+    while True:
+        with _lock:
+            cached = _aggregates_cache.get(name)
+            if cached is not None and cached[0] == version:
+                return cached[1].copy()
+            event = _pending.get(key)
+            owner = event is None
+            if owner:
+                event = _pending[key] = threading.Event()
+        if not owner:
+            event.wait()
+            continue
+        try:
+            with get_engine().connect() as conn:
+                exists = table_exists(conn, name)
+            query = f"SELECT * FROM {name}" if exists else AGGREGATES[name][0]
+            df = schema.apply_dtypes(pd.read_sql_query(query, get_engine()))
+            with _lock:
+                _aggregates_cache[name] = (version, df)
+            return df.copy()
+        finally:
+            with _lock:
+                del _pending[key]
+            event.set()
+
+
+def clear_cache():
+    global _cache_bytes
+    with _lock:
+        _columns_cache.clear()
+        _aggregates_cache.clear()
+        _cache_bytes = 0
+        _version_cache['stat'] = None
+        _version_cache['version'] = None
@@ -1,15 +1,124 @@
+"""SQLite connections shared by the apps, the API and the ingest scripts.
+
+Every connection gets the same pragmas: WAL journal (readers never block
+the writer and the writer never blocks readers), memory-mapped reads, a
+larger page cache and ``synchronous = NORMAL``, which is durable enough in
+WAL mode. Reads go through a pool of read-only connections; writes go
+through one dedicated writer connection per database, so writers of the
+same process queue up instead of failing with "database is locked".
+"""
+import os
 import sqlite3
+import threading
+from itertools import islice
 from sqlite3 import Connection
 
-def create_connection(path: str) -> Connection:
-    return sqlite3.connect(path)
+from sqlalchemy import create_engine, event
+
+# Attente maximale d'un verrou tenu par un autre processus (ms)
+BUSY_TIMEOUT_MS = 30_000
+MMAP_SIZE = int(os.environ.get('DATAML_SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+READ_POOL_SIZE = int(os.environ.get('DATAML_READ_POOL_SIZE', 8))
+
+PRAGMAS = [
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    f'PRAGMA mmap_size = {MMAP_SIZE}',
+    'PRAGMA temp_store = MEMORY',
+    f'PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}',
+]
+# Cache de pages par connexion (KiB) : les lecteurs sont nombreux, l'écrivain est seul
+READ_PRAGMAS = PRAGMAS + ['PRAGMA cache_size = -16384', 'PRAGMA query_only = ON']
+WRITE_PRAGMAS = PRAGMAS + ['PRAGMA cache_size = -65536']
+# Ajoutés à une connexion d'écriture pour un chargement en masse re-jouable : pas de fsync
+BULK_LOAD_PRAGMAS = ['PRAGMA synchronous = OFF', 'PRAGMA cache_size = -262144']
+
+DEFAULT_BATCH_SIZE = 50_000
+
+_lock = threading.Lock()
+_engines = {}
+
+
+def apply_pragmas(connection, pragmas=WRITE_PRAGMAS):
+    cursor = connection.cursor()
+    for pragma in pragmas:
+        cursor.execute(pragma)
+    cursor.close()
+
+
+def create_connection(path: str, readonly=False) -> Connection:
+    connection = sqlite3.connect(path, timeout=BUSY_TIMEOUT_MS / 1000)
+    apply_pragmas(connection, READ_PRAGMAS if readonly else WRITE_PRAGMAS)
+    return connection
+
+
+def _engine(path, readonly):
+    key = (os.path.abspath(path), readonly)
+    with _lock:
+        engine = _engines.get(key)
+        if engine is None:
+            if readonly:
+                pool = {'pool_size': READ_POOL_SIZE, 'max_overflow': READ_POOL_SIZE}
+            else:
+                # Un seul écrivain : les autres threads attendent qu'il soit rendu au pool
+                pool = {'pool_size': 1, 'max_overflow': 0, 'pool_timeout': BUSY_TIMEOUT_MS / 1000}
+            engine = create_engine(f'sqlite:///{path}',
+                                   connect_args={'check_same_thread': False,
+                                                 'timeout': BUSY_TIMEOUT_MS / 1000}, **pool)
+            pragmas = READ_PRAGMAS if readonly else WRITE_PRAGMAS
+
+            @event.listens_for(engine, 'connect')
+            def connect(dbapi_conn, _):
+                apply_pragmas(dbapi_conn, pragmas)
+                # Transactions explicites : sqlite3 validerait sinon chaque DROP/CREATE aussitôt
+                dbapi_conn.isolation_level = None
+
+            @event.listens_for(engine, 'begin')
+            def begin(conn):
+                # Verrou d'écriture pris dès le début : pas d'échec en cours de transaction
+                conn.exec_driver_sql('BEGIN' if readonly else 'BEGIN IMMEDIATE')
+            _engines[key] = engine
+        return engine
+
+
+def read_engine(path):
+    """Pooled SQLAlchemy engine of read-only connections to ``path``, shared by all threads."""
+    return _engine(path, readonly=True)
+
+
+def write_engine(path):
+    """SQLAlchemy engine holding the single writer connection to ``path``."""
+    return _engine(path, readonly=False)
+
+
+def dispose_engines():
+    # À appeler après un fork ou quand la base est remplacée
+    with _lock:
+        for engine in _engines.values():
+            engine.dispose()
+        _engines.clear()
+
 
 def execute_query(connection: Connection, query: str):
     cursor = connection.cursor()
     cursor.execute(query)
     connection.commit()
 
-def batch_insert(connection: Connection, query: str, data):
+
+def batch_insert(connection: Connection, query: str, data, batch_size=DEFAULT_BATCH_SIZE):
+    """Insert the rows of ``data`` (any iterable) with one executemany and one transaction per batch.
+
+    Returns the number of rows inserted.
+    """
+    rows = iter(data)
+    total = 0
     cursor = connection.cursor()
-    cursor.executemany(query, data)
-    connection.commit()
\ No newline at end of file
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            break
+        with connection:
+            cursor.executemany(query, batch)
+        total += len(batch)
+    cursor.close()
+    return total
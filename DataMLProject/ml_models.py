@@ -0,0 +1,280 @@
+"""Fitted recommender models and the process-wide cache that keeps them.
+
+Streamlit re-executes mlapp.py on every interaction, so the cache lives in
+this imported module: a model fitted for one (country, room type, features,
+number of clusters, data version) is reused until the data changes.
+"""
+import glob
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.cluster import KMeans
+from sklearn.neighbors import NearestNeighbors
+from sklearn.preprocessing import StandardScaler
+
+# Nombre maximal de modèles gardés en mémoire
+MAX_CACHED_MODELS = int(os.environ.get('DATAML_MAX_CACHED_MODELS', 32))
+
+# Format des modèles persistés: les fichiers d'un autre format sont ignorés
+MODEL_FORMAT = 3
+
+# Colonne des notes des voyageurs, gardée avec les modèles pour le re-classement
+REVIEW_COLUMN = 'review_scores_rating'
+
+# Registre des modèles entraînés (train_models.py), relu au démarrage de mlapp.py
+MODEL_DIR = os.environ.get('DATAML_MODEL_DIR', 'models')
+
+
+class ClusterModel:
+    """A fitted scaler and KMeans, with the cluster of each training row.
+
+    ``ranked_ids`` holds the listing ids grouped by cluster and sorted by
+    price inside each cluster; ``cluster_offsets[c]:cluster_offsets[c + 1]``
+    is the slice of cluster ``c``. ``ranked_prices`` and ``ranked_reviews``
+    are the prices and review scores in the same order, for the
+    re-ranking of ``candidates``. ``metadata`` records how the model was
+    fitted (fit time, inertia, row count, source data version) and is
+    written next to it in the registry.
+    """
+
+    def __init__(self, kmeans, scaler, features, labels, ranked_ids, cluster_offsets, metadata=None,
+                 ranked_prices=None, ranked_reviews=None):
+        self.kmeans = kmeans
+        self.scaler = scaler
+        self.features = list(features)
+        self.labels = labels
+        self.ranked_ids = ranked_ids
+        self.cluster_offsets = cluster_offsets
+        self.metadata = metadata or {}
+        self.ranked_prices = ranked_prices
+        self.ranked_reviews = ranked_reviews
+
+    def candidates(self, cluster, price, limit):
+        """Return the ids, prices and review scores of the ``limit`` listings of ``cluster`` priced closest to ``price``."""
+        first, last = self.cluster_offsets[cluster], self.cluster_offsets[cluster + 1]
+        # Fenêtre de prix contiguë autour du prix voulu (les prix du cluster sont triés)
+        middle = first + np.searchsorted(self.ranked_prices[first:last], price)
+        start = int(min(max(middle - limit // 2, first), max(last - limit, first)))
+        stop = min(start + limit, last)
+        return self.ranked_ids[start:stop], self.ranked_prices[start:stop], self.ranked_reviews[start:stop]
+
+
+class NeighbourModel:
+    """A scaler and a nearest-neighbour index over the scaled features of a slice.
+
+    Unlike ``ClusterModel`` it returns the true k nearest listings, even when
+    they sit across a KMeans cluster boundary.
+    """
+
+    def __init__(self, scaler, index, features, ids, metadata=None, prices=None, reviews=None):
+        self.scaler = scaler
+        self.index = index
+        self.features = list(features)
+        self.ids = ids
+        self.metadata = metadata or {}
+        self.prices = prices
+        self.reviews = reviews
+
+    def candidates(self, point, limit):
+        """Return the ids, prices and review scores of the ``limit`` listings nearest to ``point``."""
+        points = pd.DataFrame(np.atleast_2d(point), columns=self.features)
+        _, positions = self.index.kneighbors(self.scaler.transform(points), n_neighbors=min(limit, len(self.ids)))
+        positions = positions[0]
+        return self.ids[positions], self.prices[positions], self.reviews[positions]
+
+
+def clean_prices(df):
+    # merged_data stocke des prix numériques : seules les bases antérieures au schéma typé contiennent du texte
+    if not pd.api.types.is_numeric_dtype(df['price']):
+        df['price'] = pd.to_numeric(df['price'].replace(r'[\$,]', '', regex=True))
+    df['original_price'] = df['price']  # Conserver les prix originaux dans une nouvelle colonne
+    return df
+
+
+def review_scores(data):
+    if REVIEW_COLUMN not in data:
+        return np.full(len(data), np.nan)
+    return data[REVIEW_COLUMN].to_numpy(dtype=float)
+
+
+def fit_cluster_model(data, features, n_clusters=15, data_version=None, rank_by='original_price'):
+    start = time.perf_counter()
+    # KMeans refuse les valeurs manquantes (beds, notes) que l'ingestion en flux conserve
+    data = data.dropna(subset=features)
+    scaler = StandardScaler()
+    features_scaled = scaler.fit_transform(data[features])
+    kmeans = KMeans(n_clusters=n_clusters, random_state=0)
+    labels = kmeans.fit_predict(features_scaled)
+
+    # Listing ids grouped by cluster, cheapest first (stable, like nsmallest)
+    order = np.lexsort((data[rank_by].to_numpy(), labels))
+    ranked_ids = data['id'].to_numpy()[order]
+    ranked_prices = data[rank_by].to_numpy(dtype=float)[order]
+    cluster_offsets = np.searchsorted(labels[order], np.arange(n_clusters + 1))
+
+    metadata = {
+        'format': MODEL_FORMAT,
+        'fitted_at': datetime.now(timezone.utc).isoformat(),
+        'fit_seconds': time.perf_counter() - start,
+        'inertia': float(kmeans.inertia_),
+        'n_rows': len(data),
+        'n_clusters': n_clusters,
+        'features': list(features),
+        'data_version': data_version,
+    }
+    return ClusterModel(kmeans, scaler, features, labels, ranked_ids, cluster_offsets, metadata,
+                        ranked_prices=ranked_prices, ranked_reviews=review_scores(data)[order])
+
+
+def fit_neighbour_model(data, features, data_version=None):
+    start = time.perf_counter()
+    data = data.dropna(subset=features)
+    scaler = StandardScaler()
+    features_scaled = scaler.fit_transform(data[features])
+    index = NearestNeighbors(algorithm='kd_tree').fit(features_scaled)
+    metadata = {
+        'format': MODEL_FORMAT,
+        'fitted_at': datetime.now(timezone.utc).isoformat(),
+        'fit_seconds': time.perf_counter() - start,
+        'n_rows': len(data),
+        'features': list(features),
+        'data_version': data_version,
+    }
+    return NeighbourModel(scaler, index, features, data['id'].to_numpy(), metadata,
+                          prices=data['original_price'].to_numpy(dtype=float), reviews=review_scores(data))
+
+
+def model_key(country, room_type, features, n_clusters, data_version):
+    return (country, room_type, tuple(features), n_clusters, data_version)
+
+
+def neighbour_key(country, room_type, features, data_version):
+    return ('neighbours', country, room_type, tuple(features), data_version)
+
+
+class ModelCache:
+    """LRU cache of fitted models, backed by the registry in ``persist_dir``.
+
+    Models fitted online by ``get_or_fit`` only stay in memory; the registry
+    is written by ``put`` (train_models.py) and pruned of other data versions.
+    """
+
+    def __init__(self, max_entries=MAX_CACHED_MODELS, persist_dir=MODEL_DIR):
+        self.max_entries = max_entries
+        self.persist_dir = persist_dir
+        self._models = OrderedDict()
+        self._warmed_versions = set()
+        self._lock = threading.Lock()
+
+    def _path(self, key, extension='joblib'):
+        digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.persist_dir, f'{digest}.{extension}')
+
+    def get(self, key):
+        with self._lock:
+            if key in self._models:
+                self._models.move_to_end(key)
+                return self._models[key]
+        if self.persist_dir and os.path.exists(self._path(key)):
+            model = joblib.load(self._path(key))
+            if getattr(model, 'metadata', {}).get('format') != MODEL_FORMAT:
+                return None
+            self.put(key, model, persist=False)
+            return model
+        return None
+
+    def put(self, key, model, persist=True):
+        with self._lock:
+            self._models[key] = model
+            self._models.move_to_end(key)
+            while len(self._models) > self.max_entries:
+                self._models.popitem(last=False)
+        if persist and self.persist_dir:
+            os.makedirs(self.persist_dir, exist_ok=True)
+            _write_replace(self._path(key), lambda path: joblib.dump(model, path))
+            # The sidecar lets warm() find the models of a data version without unpickling them all
+            entry = {'key': list(key), **getattr(model, 'metadata', {})}
+            _write_replace(self._path(key, 'json'), lambda path: _dump_json(path, entry))
+
+    def get_or_fit(self, key, fit):
+        model = self.get(key)
+        if model is None:
+            model = fit()
+            # Entraîné en ligne : gardé en mémoire seulement, le registre est écrit par train_models.py
+            self.put(key, model, persist=False)
+        return model
+
+    def warm(self, data_version):
+        """Load every persisted model trained on ``data_version``; return how many were loaded.
+
+        The registry is only scanned once per data version and process.
+        """
+        if not self.persist_dir or not os.path.isdir(self.persist_dir):
+            return 0
+        with self._lock:
+            if data_version in self._warmed_versions:
+                return 0
+            self._warmed_versions.add(data_version)
+        loaded = 0
+        for key, entry in self._entries():
+            if key[-1] != data_version or entry.get('format') != MODEL_FORMAT or loaded >= self.max_entries:
+                continue
+            with self._lock:
+                if key in self._models:
+                    continue
+            self.put(key, joblib.load(self._path(key)), persist=False)
+            loaded += 1
+        return loaded
+
+    def prune(self, data_version):
+        """Delete the persisted models of another data version or format; return how many were deleted."""
+        if not self.persist_dir or not os.path.isdir(self.persist_dir):
+            return 0
+        pruned = 0
+        for key, entry in self._entries():
+            if key[-1] == data_version and entry.get('format') == MODEL_FORMAT:
+                continue
+            # Le sidecar d'abord : warm() ne trouve plus un modèle dont le fichier va disparaître
+            for path in (self._path(key, 'json'), self._path(key)):
+                if os.path.exists(path):
+                    os.remove(path)
+            pruned += 1
+        return pruned
+
+    def _entries(self):
+        for path in glob.glob(os.path.join(self.persist_dir, '*.json')):
+            with open(path, encoding='utf-8') as f:
+                entry = json.load(f)
+            yield tuple(tuple(part) if isinstance(part, list) else part for part in entry['key']), entry
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
+            self._warmed_versions.clear()
+
+
+def _write_replace(path, write):
+    # Écrit à côté puis renomme : un lecteur ne voit jamais un fichier à moitié écrit
+    tmp = f'{path}.{os.getpid()}.tmp'
+    try:
+        write(tmp)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def _dump_json(path, entry):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(entry, f, indent=2)
+
+
+model_cache = ModelCache()
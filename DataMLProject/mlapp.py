@@ -1,63 +1,101 @@
+import math
+import uuid
 import streamlit as st
-import pandas as pd
-from sqlalchemy import create_engine
-from sklearn.cluster import KMeans
-from sklearn.preprocessing import StandardScaler
+import data_access
+import ml_models
+import ratings
+import recommender
+from recommender import (NEIGHBOUR_FEATURES, DISPLAY_COLUMNS, PAGE_SIZE, RERANK_CANDIDATES, get_clustering,
+                         get_neighbour_model, find_nearest_cluster, ranked_page)
+
+# Méthodes de recommandation
+KMEANS_BACKEND = 'Clusters (KMeans)'
+NEIGHBOURS_BACKEND = 'Plus proches voisins'
 
 def load_data():
-    engine = create_engine('sqlite:///airbnb_data.db')
-    query = "SELECT * FROM merged_data"
-    df = pd.read_sql(query, engine)
-    df['price'] = df['price'].replace('[\$,]', '', regex=True).astype(int)
-    df['original_price'] = df['price']  # Conserver les prix originaux dans une nouvelle colonne
-    return df, engine
+    return recommender.load_data()
 
 def perform_clustering(data, features_list, n_clusters=15):
-    scaler = StandardScaler()
-    features_scaled = scaler.fit_transform(data[features_list])
-    kmeans = KMeans(n_clusters=n_clusters, random_state=0)
-    clusters = kmeans.fit_predict(features_scaled)
-    data['cluster'] = clusters
-    return kmeans, scaler
-
-def find_nearest_cluster(model, user_input, scaler, features_list):
-    user_df = pd.DataFrame([user_input], columns=features_list)
-    scaled_input = scaler.transform(user_df)
-    cluster = model.predict(scaled_input)[0]
-    return cluster
-
-def save_rating(engine, listing_id, rating):
-    with engine.connect() as conn:
-        conn.execute(
-            "INSERT INTO ratings (listing_id, rating) VALUES (?, ?) ON CONFLICT(listing_id) DO UPDATE SET rating = excluded.rating",
-            (listing_id, rating))
+    model = ml_models.fit_cluster_model(data, features_list, n_clusters)
+    # Les logements sans valeur pour une des variables restent sans cluster
+    data.loc[data[features_list].notna().all(axis=1), 'cluster'] = model.labels
+    return model.kmeans, model.scaler
+
+def rater_id():
+    # Identifiant anonyme du visiteur, stable pendant la session
+    if 'rater_id' not in st.session_state:
+        st.session_state['rater_id'] = uuid.uuid4().hex
+    return st.session_state['rater_id']
+
+def save_rating(listing_id, rating):
+    # Mise en file : l'écriture en base est groupée par ratings.py
+    ratings.submit(listing_id, rater_id(), rating)
 
 def main():
-    df, engine = load_data()
+    df = load_data()
+
+    # Chargement (une fois par version des données) des modèles pré-entraînés par train_models.py
+    ml_models.model_cache.warm(data_access.get_data_version())
     st.title("Système de recommandation de logements")
 
     selected_country = st.selectbox('Dans quel pays cherchez-vous un logement ?', df['country'].dropna().unique(), key='country')
     selected_room_type = st.selectbox('Quel type de chambre cherchez-vous ?', df['room_type'].unique(), key='room_type')
 
-    filtered_df = df[(df['country'] == selected_country) & (df['room_type'] == selected_room_type)]
-    features_list = ['price', 'beds']
-    kmeans, scaler = perform_clustering(filtered_df, features_list)
+    filtered_df = recommender.select_slice(df, selected_country, selected_room_type)
+    backend = st.radio('Méthode de recommandation', [KMEANS_BACKEND, NEIGHBOURS_BACKEND], horizontal=True)
+
+    if backend == KMEANS_BACKEND:
+        if not recommender.can_cluster(filtered_df):
+            st.warning("Trop peu de logements pour former des clusters : utilisez la recherche par plus proches voisins.")
+            return
+        features_list = recommender.CLUSTER_FEATURES
+        model = get_clustering(filtered_df, selected_country, selected_room_type, features_list)
 
-    user_inputs = [st.number_input("Entrez votre valeur préférée pour " + feature, value=int(filtered_df[feature].mean())) for feature in features_list]
-    cluster = find_nearest_cluster(kmeans, user_inputs, scaler, features_list)
-    cluster_data = filtered_df[filtered_df['cluster'] == cluster]
-    top_listings = cluster_data.nsmallest(10, 'original_price')
+        user_inputs = [st.number_input("Entrez votre valeur préférée pour " + feature, value=int(filtered_df[feature].mean())) for feature in features_list]
+        cluster = find_nearest_cluster(model.kmeans, user_inputs, model.scaler, features_list)
+        # Candidats du cluster les plus proches du prix voulu, re-classés avec les notes
+        target_price = user_inputs[features_list.index('price')]
+        candidates = model.candidates(cluster, target_price, RERANK_CANDIDATES)
+        title = f"Les 10 meilleurs logements dans le cluster {cluster + 1}"
+    else:
+        features_list = st.multiselect('Critères de similarité', NEIGHBOUR_FEATURES, default=['price', 'beds'])
+        if not features_list:
+            st.warning("Sélectionnez au moins un critère.")
+            return
+        model = get_neighbour_model(filtered_df, selected_country, selected_room_type, features_list)
 
-    st.subheader(f"Les 10 meilleurs logements dans le cluster {cluster + 1}")
+        user_inputs = [st.number_input("Entrez votre valeur préférée pour " + feature, value=float(round(filtered_df[feature].mean(), 4))) for feature in features_list]
+
+        # Les plus proches logements, quel que soit leur cluster, re-classés avec les notes
+        candidates = model.candidates(user_inputs, RERANK_CANDIDATES)
+        target_price = user_inputs[features_list.index('price')] if 'price' in features_list else filtered_df['price'].mean()
+        title = "Les 10 logements les plus proches de vos critères"
+
+    n_pages = max(1, math.ceil(len(candidates[0]) / PAGE_SIZE))
+    page = st.number_input("Page", min_value=1, max_value=n_pages, value=1, step=1)
+    listing_ids, _ = ranked_page(candidates, target_price, page, PAGE_SIZE)
+
+    top_listings = ml_models.clean_prices(data_access.load_listings(listing_ids, DISPLAY_COLUMNS))
+    listing_ratings = ratings.listing_ratings(top_listings['id']).set_index('listing_id')
+
+    st.subheader(title)
+    # Seuls les RERANK_CANDIDATES logements les plus proches de la recherche sont classés
+    st.caption(f"Page {page} sur {n_pages} : les {len(candidates[0])} logements les plus proches de vos critères"
+               + (" (fin des recommandations)" if page == n_pages else ""))
     for index, row in top_listings.iterrows():
         with st.container():
             st.image(row['picture_url'], width=300)
             link = f"<a href='{row['listing_url']}' target='_blank'>{row['name']}</a> - ${row['original_price']} per night"
             st.markdown(link, unsafe_allow_html=True)
+            if row['id'] in listing_ratings.index:
+                stats = listing_ratings.loc[row['id']]
+                st.caption(f"Note des visiteurs : {stats['rating_mean']:.1f}/5 ({int(stats['rating_count'])} avis)")
             rating_key = f"rate_{row['id']}"
             rating = st.slider("Notez ce logement de 1 à 5 étoiles", 1, 5, value=st.session_state.get(rating_key, 3), step=1, key=rating_key)
-            save_btn = st.button("Enregistrer la note", key=f"save_{row['id']}")
-        
+            if st.button("Enregistrer la note", key=f"save_{row['id']}"):
+                save_rating(row['id'], rating)
+                st.success("Merci, votre note a été enregistrée.")
+
 
 if __name__ == "__main__":
     main()
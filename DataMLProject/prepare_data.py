@@ -1,85 +1,386 @@
+import argparse
+import hashlib
+import logging
+import numpy as np
 import pandas as pd
 import os
-from sqlalchemy import create_engine
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import columnar
+import data_access
+import schema
+from aggregates import materialize_aggregates
+from spatial import build_spatial_index
 
-def clean_data(df):
-    # Drop columns with more than 50% missing values
-    threshold = len(df) * 0.5
-    df = df.dropna(thresh=threshold, axis=1)
+logger = logging.getLogger(__name__)
 
-    # Drop rows with any remaining missing values
-    df = df.dropna()
+# Rows read per CSV chunk and written per INSERT batch in streaming mode
+DEFAULT_CHUNKSIZE = 50_000
 
-    # Removing duplicates
-    df = df.drop_duplicates()
+# Listing columns kept by the streaming ingest, with explicit dtypes
+LISTING_DTYPES = {
+    'id': 'int64',
+    'listing_url': str,
+    'name': str,
+    'picture_url': str,
+    'neighborhood_overview': str,
+    'host_since': str,
+    'host_is_superhost': str,
+    'neighbourhood': str,
+    'neighbourhood_cleansed': str,
+    'latitude': 'float64',
+    'longitude': 'float64',
+    'property_type': str,
+    'room_type': str,
+    'accommodates': 'float64',
+    'beds': 'float64',
+    'price': str,
+    'availability_365': 'float64',
+    'number_of_reviews': 'float64',
+    'last_scraped': str,
+    'calendar_last_scraped': str,
+    'first_review': str,
+    'last_review': str,
+    'review_scores_rating': 'float64',
+    'review_scores_value': 'float64',
+}
 
-    # Convert 'host_since' to datetime
-    df['host_since'] = pd.to_datetime(df['host_since'], errors='coerce')
+# Per-city CSV files, tracked by the ingest manifest
+CITY_FILES = ('listings.csv', 'reviews.csv')
+MANIFEST_TABLE = 'ingest_manifest'
 
-    # Cleaning the 'price' column
-    df['price'] = df['price'].str.replace(',', '').str.replace('$', '')
-    df['price'] = pd.to_numeric(df['price'], errors='coerce')
+# Rows missing one of these values are dropped in streaming mode
+REQUIRED_COLUMNS = ['id', 'price', 'neighbourhood', 'room_type', 'latitude', 'longitude']
 
-    # Remove rows with non-numeric prices
-    df = df.dropna(subset=['price'])
+# Aliases of the 'neighbourhood' parts ("City, Department, Country"), applied before the city case is normalized
+LOCATION_ALIASES = {
+    'city': {
+        'París': 'Paris', 'France': 'Paris', 'Paris city': 'Paris', 'Île-de-France': 'Paris',
+        'Milano': 'Milan',
+        'Italy': 'Lombardia',
+        'UK': 'London', 'United Kingdom': 'London', 'England': 'London', 'Greater London': 'London',
+        'Central London': 'London',
+    },
+    'country': {
+        'FR': 'France',
+        'Central London': 'United Kingdom', 'Greater London': 'United Kingdom', 'London': 'United Kingdom',
+        'England': 'United Kingdom',
+        'Lombardia': 'Italy',
+    },
+}
+
+def split_locations(neighbourhood):
+    # city, department and country are computed on the distinct 'neighbourhood' values only
+    # and returned as categoricals sharing the row codes
+    codes, uniques = pd.factorize(neighbourhood)
+    parts = pd.Series(uniques, dtype=object).str.split(', ', expand=True).reindex(columns=range(3))
+    locations = {
+        'city': parts[0].replace(LOCATION_ALIASES['city']).str.lower().str.strip().str.title(),
+        'department': parts[1],
+        'country': parts[2].replace(LOCATION_ALIASES['country']),
+    }
+    columns = {}
+    for name, values in locations.items():
+        value_codes, categories = pd.factorize(values)
+        row_codes = np.where(codes >= 0, np.append(value_codes, -1)[codes], -1)
+        columns[name] = pd.Categorical.from_codes(row_codes, categories)
+    return pd.DataFrame(columns, index=neighbourhood.index)
 
-    # Split 'neighbourhood' into three new columns
-    location_split = df['neighbourhood'].str.split(', ', expand=True)
-    df['city'] = location_split[0]
-    df['department'] = location_split[1]
-    df['country'] = location_split[2]
+def parse_prices(prices):
+    if pd.api.types.is_numeric_dtype(prices):
+        return prices
+    # Parsed once per distinct value ("$1,234.00"), then broadcast back to the rows
+    codes, uniques = pd.factorize(prices)
+    parsed = pd.to_numeric(pd.Series(uniques, dtype=object).str.replace(r'[$,]', '', regex=True), errors='coerce')
+    return np.append(parsed.to_numpy(dtype=float), np.nan)[codes]
 
-    # Remove original 'neighbourhood' column
-    df = df.drop('neighbourhood', axis=1)
+def clean_data(df, required=None):
+    """Clean one city's listings (merged with their reviews) for merged_data.
 
-    # Remove original 'amenities' column
-    df = df.drop('amenities', axis=1)
+    Dates come back as datetime64 (written to SQLite as ISO dates by
+    schema.to_storage), prices as floats, and city, department and country
+    as categoricals derived from 'neighbourhood' through LOCATION_ALIASES.
+    """
+    # The streaming ingest passes `required`: its columns are fixed up front,
+    # so sparse columns are kept and only incomplete required values drop a row
+    if required is None:
+        # Drop columns with more than 50% missing values
+        threshold = len(df) * 0.5
+        df = df.dropna(thresh=threshold, axis=1)
 
-    # Clean city names (remove case-sensitive duplicates)
-    df['city'] = df['city'].replace(['París','France','Paris city', 'Île-de-France'], 'Paris')
-    df['city'] = df['city'].replace(['Milano'], 'Milan')
-    df['city'] = df['city'].replace(['Italy'], 'Lombardia')
-    df['city'] = df['city'].replace(['UK','United Kingdom', 'England', 'Greater London', 'Central London'], 'London')
-    df['city'] = df['city'].str.lower().str.strip().drop_duplicates().str.title()
+        # Drop rows with any remaining missing values
+        df = df.dropna()
+    else:
+        df = df.dropna(subset=required)
 
+    # One row per listing
+    df = df.drop_duplicates(subset='id')
+
+    # Numeric prices only
+    df = df.assign(price=parse_prices(df['price']))
+    df = df.dropna(subset=['price'])
 
-    # Clean country names
-    df['country'] = df['country'].replace({'FR': 'France'})
-    df['country'] = df['country'].replace(['Central London', 'Greater London', 'London', 'England'], 'United Kingdom')
-    df['country'] = df['country'].replace({'Lombardia': 'Italy'})
+    # Split 'neighbourhood' into city, department and country, then drop it with 'amenities'
+    df = pd.concat([df.drop(columns=['neighbourhood', 'amenities'], errors='ignore'),
+                    split_locations(df['neighbourhood'])], axis=1)
 
-    # Convert date columns to datetime
-    date_columns = ['last_scraped', 'calendar_last_scraped', 'first_review', 'last_review']
-    for col in date_columns:
-        df[col] = pd.to_datetime(df[col], errors='coerce').dt.strftime('%d-%m-%Y')
+    # Dates stay datetime64 in memory
+    for col in schema.DATE_COLUMNS:
+        if col in df:
+            df[col] = pd.to_datetime(df[col], format='ISO8601', errors='coerce')
 
     return df
 
-def merge_and_insert_data(base_path='ml'):
-    engine = create_engine('sqlite:///airbnb_data.db')
-    final_df = pd.DataFrame()
+def read_city(city_path):
+    listings_path = os.path.join(city_path, 'listings.csv')
+    reviews_path = os.path.join(city_path, 'reviews.csv')
+
+    # Read the CSV files
+    listings_df = pd.read_csv(listings_path, encoding='utf-8')
+    reviews_df = pd.read_csv(reviews_path, encoding='utf-8')
+
+    # Merge DataFrames on the 'id' column
+    merged_df = pd.merge(listings_df, reviews_df, on='id', how='left')
+
+    # Clean the merged data and tag it with its city key
+    merged_df = clean_data(merged_df)
+    merged_df['source_city'] = os.path.basename(city_path)
+    return merged_df
+
+def count_reviews(reviews_path, chunksize=DEFAULT_CHUNKSIZE):
+    # Only the listing key is read: memory grows with listings, not reviews
+    counts = pd.Series(dtype='int64')
+    for chunk in pd.read_csv(reviews_path, usecols=['listing_id'], dtype={'listing_id': 'int64'},
+                             chunksize=chunksize, encoding='utf-8'):
+        counts = counts.add(chunk['listing_id'].value_counts(), fill_value=0)
+    return counts.astype('int64').rename('review_count')
+
+def stream_city(city_path, chunksize=DEFAULT_CHUNKSIZE):
+    listings_path = os.path.join(city_path, 'listings.csv')
+    reviews_path = os.path.join(city_path, 'reviews.csv')
+
+    # Aggregate reviews per listing before joining them to the listings
+    review_counts = count_reviews(reviews_path, chunksize)
+
+    for chunk in pd.read_csv(listings_path, usecols=list(LISTING_DTYPES), dtype=LISTING_DTYPES,
+                             chunksize=chunksize, encoding='utf-8'):
+        chunk = chunk.join(review_counts, on='id')
+        chunk['review_count'] = chunk['review_count'].fillna(0).astype('int64')
+        chunk = clean_data(chunk, required=REQUIRED_COLUMNS)
+        chunk['source_city'] = os.path.basename(city_path)
+        yield chunk
+
+def list_city_paths(base_path):
+    city_paths = [os.path.join(base_path, city) for city in sorted(os.listdir(base_path))]
+    return [city_path for city_path in city_paths if os.path.isdir(city_path)]
+
+def process_city(city_path, streaming=False, chunksize=DEFAULT_CHUNKSIZE):
+    # Read, merge and clean one city; runs inside a worker process in parallel mode
+    start = time.perf_counter()
+    if streaming:
+        df = pd.concat(stream_city(city_path, chunksize), ignore_index=True)
+    else:
+        df = read_city(city_path)
+    return city_path, df, time.perf_counter() - start
+
+def process_cities(city_paths, streaming, chunksize, workers):
+    # Yield (city_path, df, seconds) as cities finish, across `workers` processes
+    if workers <= 1:
+        for city_path in city_paths:
+            yield process_city(city_path, streaming, chunksize)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(process_city, city_path, streaming, chunksize) for city_path in city_paths]
+        for future in as_completed(futures):
+            yield future.result()
+
+def city_signature(city_path):
+    # Combined size and latest mtime of the city's CSV files
+    stats = [os.stat(os.path.join(city_path, name)) for name in CITY_FILES]
+    return sum(stat.st_size for stat in stats), max(stat.st_mtime_ns for stat in stats)
+
+def city_hash(city_path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    for name in CITY_FILES:
+        with open(os.path.join(city_path, name), 'rb') as f:
+            for block in iter(lambda: f.read(block_size), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+def read_manifest(conn):
+    if not data_access.table_exists(conn, MANIFEST_TABLE):
+        return {}
+    rows = conn.exec_driver_sql(f"SELECT city, size, mtime_ns, sha256 FROM {MANIFEST_TABLE}")
+    return {city: (size, mtime_ns, sha256) for city, size, mtime_ns, sha256 in rows}
+
+def update_manifest(conn, city, size, mtime_ns, sha256):
+    conn.exec_driver_sql(
+        f"CREATE TABLE IF NOT EXISTS {MANIFEST_TABLE} "
+        "(city TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, sha256 TEXT, ingested_at REAL)")
+    conn.exec_driver_sql(
+        f"INSERT INTO {MANIFEST_TABLE} (city, size, mtime_ns, sha256, ingested_at) VALUES (?, ?, ?, ?, ?) "
+        "ON CONFLICT(city) DO UPDATE SET size = excluded.size, mtime_ns = excluded.mtime_ns, "
+        "sha256 = excluded.sha256, ingested_at = excluded.ingested_at",
+        (city, size, mtime_ns, sha256, time.time()))
+
+def add_missing_columns(conn, df, table='merged_data'):
+    # A re-ingested city may keep columns the table does not have yet
+    existing = set(data_access.table_columns(conn, table))
+    for col in df.columns:
+        if col not in existing:
+            conn.exec_driver_sql(
+                f'ALTER TABLE {table} ADD COLUMN {schema.quote(col)} {schema.column_type(col, df[col].dtype)}')
+
+def write_frame(conn, df, chunksize=None):
+    # Rows go into the typed table; a listing id seen twice keeps its last row
+    schema.to_storage(df).to_sql('merged_data', conn, if_exists='append', index=False, chunksize=chunksize,
+                                 method=schema.insert_or_replace)
+
+def append_frame(engine, df, chunksize, created):
+    # The first frame replaces the table with the typed schema; later ones may add columns
+    with engine.begin() as conn:
+        if created:
+            add_missing_columns(conn, df)
+        else:
+            conn.exec_driver_sql("DROP TABLE IF EXISTS merged_data")
+            schema.create_table(conn, df)
+        write_frame(conn, df, chunksize)
+    return True
+
+def find_changed_cities(engine, city_paths):
+    # Size and mtime are checked first; files are only hashed when they differ
+    with engine.connect() as conn:
+        manifest = read_manifest(conn)
+    changed = {}
+    for city_path in city_paths:
+        city = os.path.basename(city_path)
+        size, mtime_ns = city_signature(city_path)
+        entry = manifest.get(city)
+        if entry is not None and entry[:2] == (size, mtime_ns):
+            continue
+        sha256 = city_hash(city_path)
+        if entry is not None and entry[2] == sha256:
+            # Touched but identical content: only refresh the manifest
+            with engine.begin() as conn:
+                update_manifest(conn, city, size, mtime_ns, sha256)
+            continue
+        changed[city_path] = (size, mtime_ns, sha256)
+    removed = set(manifest) - {os.path.basename(city_path) for city_path in city_paths}
+    return changed, removed
+
+def ingest_changed_cities(engine, city_paths, streaming, chunksize, workers):
+    changed, removed = find_changed_cities(engine, city_paths)
+
+    for city in removed:
+        with engine.begin() as conn:
+            conn.exec_driver_sql("DELETE FROM merged_data WHERE source_city = ?", (city,))
+            conn.exec_driver_sql(f"DELETE FROM {MANIFEST_TABLE} WHERE city = ?", (city,))
+        logger.info("%s: removed", city)
+
+    # Each changed city is replaced by its key in a single transaction
+    for city_path, df, elapsed in process_cities(list(changed), streaming, chunksize, workers):
+        city = os.path.basename(city_path)
+        write_start = time.perf_counter()
+        with engine.begin() as conn:
+            add_missing_columns(conn, df)
+            conn.exec_driver_sql("DELETE FROM merged_data WHERE source_city = ?", (city,))
+            write_frame(conn, df, chunksize)
+            update_manifest(conn, city, *changed[city_path])
+        logger.info("%s: %d rows, processed in %.2fs, written in %.2fs", city, len(df), elapsed,
+                    time.perf_counter() - write_start)
+
+    return bool(changed or removed)
+
+def can_ingest_incrementally(engine):
+    with engine.connect() as conn:
+        # Databases written before the typed schema are ingested again in full
+        return (data_access.table_exists(conn, 'merged_data')
+                and 'source_city' in data_access.table_columns(conn, 'merged_data')
+                and schema.has_typed_schema(conn))
+
+def ingest_all_cities(engine, city_paths, streaming, chunksize, workers):
+    if streaming and workers <= 1:
+        # Append each cleaned chunk as it is produced: peak memory is bounded by the chunk size
+        created = False
+        for city_path in city_paths:
+            city_start = time.perf_counter()
+            for chunk in stream_city(city_path, chunksize):
+                created = append_frame(engine, chunk, chunksize, created)
+            logger.info("%s: %.2fs", os.path.basename(city_path), time.perf_counter() - city_start)
+    elif streaming:
+        # Cities are processed by the pool; this process is the only SQLite writer
+        created = False
+        for city_path, df, elapsed in process_cities(city_paths, streaming, chunksize, workers):
+            write_start = time.perf_counter()
+            created = append_frame(engine, df, chunksize, created)
+            logger.info("%s: %d rows, processed in %.2fs, written in %.2fs", os.path.basename(city_path),
+                        len(df), elapsed, time.perf_counter() - write_start)
+    else:
+        # Cleaned cities may keep different columns: align them with a single concat at the end
+        frames = []
+        for city_path, df, elapsed in process_cities(city_paths, streaming, chunksize, workers):
+            logger.info("%s: %d rows, processed in %.2fs", os.path.basename(city_path), len(df), elapsed)
+            frames.append(df)
+        final_df = pd.concat(frames, ignore_index=True)
+
+        # Insert the final DataFrame into SQLite
+        append_frame(engine, final_df, None, created=False)
+
+    # Record every city so that the next incremental ingest can skip it
+    with engine.begin() as conn:
+        conn.exec_driver_sql(f"DROP TABLE IF EXISTS {MANIFEST_TABLE}")
+        for city_path in city_paths:
+            update_manifest(conn, os.path.basename(city_path), *city_signature(city_path), city_hash(city_path))
+
+def merge_and_insert_data(base_path='ml', streaming=False, chunksize=DEFAULT_CHUNKSIZE, workers=1,
+                          incremental=False):
+    engine = data_access.get_writer()
+    city_paths = list_city_paths(base_path)
+    start = time.perf_counter()
+
+    if incremental and can_ingest_incrementally(engine):
+        # Only cities whose files changed since the last ingest are reprocessed
+        if not ingest_changed_cities(engine, city_paths, streaming, chunksize, workers):
+            logger.info("No city changed since the last ingest (%.2fs)", time.perf_counter() - start)
+            return
+    else:
+        ingest_all_cities(engine, city_paths, streaming, chunksize, workers)
 
-    for city in os.listdir(base_path):
-        city_path = os.path.join(base_path, city)
-        if os.path.isdir(city_path):
-            listings_path = os.path.join(city_path, 'listings.csv')
-            reviews_path = os.path.join(city_path, 'reviews.csv')
+    with engine.begin() as conn:
+        # Index the city key used by incremental ingests and the filter columns of the apps
+        # (listing ids are looked up through the primary key)
+        schema.create_indexes(conn)
 
-            # Read the CSV files
-            listings_df = pd.read_csv(listings_path, encoding='utf-8')
-            reviews_df = pd.read_csv(reviews_path, encoding='utf-8')
+        # Materialize the summary tables read by the dashboard
+        materialize_aggregates(conn)
 
-            # Merge DataFrames on the 'id' column
-            merged_df = pd.merge(listings_df, reviews_df, on='id', how='left')
+        # Spatial index for viewport and radius queries
+        build_spatial_index(conn)
 
-            # Clean the merged data
-            merged_df = clean_data(merged_df)
+    # Columnar snapshot read by the dashboards instead of SQLite (needs pyarrow)
+    version = str(time.time_ns())
+    columnar.write_snapshot(data_access.get_engine(), version)
 
-            # Concatenate with the final DataFrame
-            final_df = pd.concat([final_df, merged_df], ignore_index=True)
+    # Stamp the new data version so the dashboards invalidate their caches
+    data_access.write_data_version(engine, version)
+    columnar.remove_old_snapshots(version)
+    logger.info("Ingested %d cities in %.2fs", len(city_paths), time.perf_counter() - start)
 
-    # Insert the final DataFrame into SQLite
-    final_df.to_sql('merged_data', engine, if_exists='replace', index=False)
+def parse_args():
+    parser = argparse.ArgumentParser(description="Load the Airbnb city CSVs into airbnb_data.db")
+    parser.add_argument('--base-path', default='ml', help="directory holding one sub-directory per city")
+    parser.add_argument('--streaming', action='store_true',
+                        help="read the CSVs in chunks and append them to SQLite as they are cleaned")
+    parser.add_argument('--chunksize', type=int, default=DEFAULT_CHUNKSIZE,
+                        help="rows per CSV chunk and per INSERT batch in streaming mode")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="number of processes reading and cleaning cities in parallel")
+    parser.add_argument('--incremental', action='store_true',
+                        help="only reprocess the cities whose CSV files changed since the last ingest")
+    return parser.parse_args()
 
 if __name__ == '__main__':
-    merge_and_insert_data()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    args = parse_args()
+    merge_and_insert_data(args.base_path, streaming=args.streaming, chunksize=args.chunksize,
+                          workers=args.workers, incremental=args.incremental)
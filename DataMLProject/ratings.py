@@ -0,0 +1,275 @@
+"""Write-behind store for the ratings given in the recommender.
+
+Ratings are queued in memory and written in batches: a visitor rating the
+same listing several times before a flush only writes the last value, and
+one transaction covers a whole batch instead of one per click. A batch is
+flushed once it holds FLUSH_SIZE ratings or after FLUSH_SECONDS, by a
+background thread, and when the process exits.
+
+The tables (DataMLApp_rating, one row per listing and visitor, and
+DataMLApp_listingrating, the per-listing totals) are created by the Django
+migrations: ``python manage.py migrate``. The totals are updated from the
+difference between the new and the previous rating of each visitor, so
+reading the rating of a listing never scans the individual ratings.
+RatingStats keeps the same totals in memory for the recommender's
+re-ranking: each batch is written through it and applied in O(1) per
+listing.
+"""
+import atexit
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+from sqlalchemy.exc import OperationalError
+
+import db
+
+logger = logging.getLogger(__name__)
+
+RATINGS_DB = os.environ.get('DATAML_RATINGS_DB', 'db.sqlite3')
+RATINGS_TABLE = 'DataMLApp_rating'
+TOTALS_TABLE = 'DataMLApp_listingrating'
+
+# Seuils d'écriture : nombre de notes en attente ou délai depuis la dernière écriture
+FLUSH_SIZE = int(os.environ.get('DATAML_RATINGS_FLUSH_SIZE', 100))
+FLUSH_SECONDS = float(os.environ.get('DATAML_RATINGS_FLUSH_SECONDS', 2.0))
+
+# Note a priori du score bayésien : un logement sans avis vaut PRIOR_MEAN, comme s'il avait PRIOR_WEIGHT avis
+PRIOR_MEAN = 3.0
+PRIOR_WEIGHT = 5
+
+# Relecture périodique des totaux, pour voir les notes écrites par un autre processus
+STATS_RELOAD_SECONDS = float(os.environ.get('DATAML_RATINGS_RELOAD_SECONDS', 60))
+
+# Bases sans tables de notes déjà signalées dans le journal
+_unmigrated = set()
+
+
+class MissingTablesError(RuntimeError):
+    """The ratings database has not been migrated."""
+
+
+def _missing_table(exc):
+    return 'no such table' in str(exc)
+
+
+def _log_unmigrated(path):
+    # Une fois par base : la page des recommandations lit les notes à chaque interaction
+    if path not in _unmigrated:
+        _unmigrated.add(path)
+        logger.warning("No rating tables in %s yet, run `python manage.py migrate`", path)
+
+
+class RatingQueue:
+
+    def __init__(self, path=RATINGS_DB, flush_size=FLUSH_SIZE, flush_seconds=FLUSH_SECONDS):
+        self.path = path
+        self.flush_size = flush_size
+        self.flush_seconds = flush_seconds
+        self._lock = threading.Lock()
+        # Une écriture à la fois : le thread de fond et les flush explicites ne se chevauchent pas
+        self._flush_lock = threading.Lock()
+        self._pending = {}
+        self._wake = threading.Event()
+        self._thread = None
+
+    def submit(self, listing_id, rater_id, rating):
+        """Queue ``rating`` (1 to 5) of ``rater_id`` for ``listing_id``; it replaces a queued one."""
+        if not 1 <= rating <= 5:
+            raise ValueError(f"rating must be between 1 and 5, got {rating}")
+        with self._lock:
+            self._pending[int(listing_id), str(rater_id)] = (int(rating), _now())
+            full = len(self._pending) >= self.flush_size
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='ratings-flush', daemon=True)
+                self._thread.start()
+        if full:
+            self._wake.set()
+
+    def pending(self):
+        with self._lock:
+            return {key: rating for key, (rating, _) in self._pending.items()}
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_seconds)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                # Les notes restent en attente et seront réécrites au prochain passage
+                logger.exception("Could not write %d ratings to %s", len(self._pending), self.path)
+
+    def flush(self):
+        """Write the queued ratings in one transaction and return how many were written."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+            if not batch:
+                return 0
+            try:
+                get_stats(self.path).write(batch)
+            except MissingTablesError:
+                # Le lot échouerait à chaque passage : il est abandonné plutôt que remis en file
+                raise
+            except Exception:
+                with self._lock:
+                    # Une note plus récente arrivée entre-temps est gardée
+                    for key, value in batch.items():
+                        self._pending.setdefault(key, value)
+                raise
+            return len(batch)
+
+
+def _now():
+    # Format des DateTimeField de Django sous SQLite (UTC, USE_TZ = True)
+    return datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S.%f')
+
+
+def write_batch(path, batch):
+    """Upsert ``{(listing_id, rater_id): (rating, updated_at)}`` and update the listing totals.
+
+    Returns the change of each listing's totals, ``{listing_id: (count, sum)}``.
+    """
+    conn = db.create_connection(path)
+    conn.isolation_level = None
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        totals = {}
+        for (listing_id, rater_id), (rating, _) in batch.items():
+            previous = conn.execute(
+                f"SELECT rating FROM {RATINGS_TABLE} WHERE listing_id = ? AND rater_id = ?",
+                (listing_id, rater_id)).fetchone()
+            count, total = totals.get(listing_id, (0, 0))
+            if previous is None:
+                totals[listing_id] = (count + 1, total + rating)
+            else:
+                totals[listing_id] = (count, total + rating - previous[0])
+        conn.executemany(
+            f"INSERT INTO {RATINGS_TABLE} (listing_id, rater_id, rating, updated_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(listing_id, rater_id) DO UPDATE SET rating = excluded.rating, updated_at = excluded.updated_at",
+            [(listing_id, rater_id, rating, updated_at)
+             for (listing_id, rater_id), (rating, updated_at) in batch.items()])
+        conn.executemany(
+            f"INSERT INTO {TOTALS_TABLE} (listing_id, rating_count, rating_sum) VALUES (?, ?, ?) "
+            "ON CONFLICT(listing_id) DO UPDATE SET rating_count = rating_count + excluded.rating_count, "
+            "rating_sum = rating_sum + excluded.rating_sum",
+            [(listing_id, count, total) for listing_id, (count, total) in totals.items()])
+        conn.execute('COMMIT')
+        return totals
+    except sqlite3.Error as exc:
+        if conn.in_transaction:
+            conn.execute('ROLLBACK')
+        if _missing_table(exc):
+            raise MissingTablesError(
+                f"{path} has no rating tables, run `python manage.py migrate`: {len(batch)} ratings dropped") from exc
+        raise
+    finally:
+        conn.close()
+
+
+def listing_ratings(listing_ids, path=RATINGS_DB):
+    """Return the rating count and mean of ``listing_ids`` (listings without rating are absent)."""
+    columns = ['listing_id', 'rating_count', 'rating_mean']
+    ids = [int(listing_id) for listing_id in listing_ids]
+    if not ids:
+        return pd.DataFrame(columns=columns)
+    query = (f"SELECT listing_id, rating_count, CAST(rating_sum AS REAL) / rating_count AS rating_mean "
+             f"FROM {TOTALS_TABLE} WHERE rating_count > 0 AND listing_id IN ({', '.join('?' * len(ids))})")
+    try:
+        with db.read_engine(path).connect() as conn:
+            rows = conn.exec_driver_sql(query, tuple(ids)).fetchall()
+    except OperationalError as exc:
+        if not _missing_table(exc):
+            raise
+        # Base non migrée : aucune note pour l'instant
+        _log_unmigrated(path)
+        rows = []
+    return pd.DataFrame(rows, columns=columns)
+
+
+class RatingStats:
+    """In-memory rating count and sum per listing, with their Bayesian-smoothed mean."""
+
+    def __init__(self, path=RATINGS_DB, reload_seconds=STATS_RELOAD_SECONDS):
+        self.path = path
+        self.reload_seconds = reload_seconds
+        self._lock = threading.Lock()
+        self._totals = {}
+        self._loaded_at = None
+
+    def _load(self):
+        try:
+            with db.read_engine(self.path).connect() as conn:
+                rows = conn.exec_driver_sql(
+                    f"SELECT listing_id, rating_count, rating_sum FROM {TOTALS_TABLE} WHERE rating_count > 0").fetchall()
+        except Exception as exc:
+            if _missing_table(exc):
+                # Base non migrée : aucune note pour l'instant
+                _log_unmigrated(self.path)
+            else:
+                logger.warning("Could not read the rating totals from %s: %s", self.path, exc)
+            rows = []
+        self._totals = {listing_id: (count, total) for listing_id, count, total in rows}
+        self._loaded_at = time.monotonic()
+
+    def _fresh(self):
+        if self._loaded_at is None or time.monotonic() - self._loaded_at > self.reload_seconds:
+            self._load()
+        return self._totals
+
+    def write(self, batch):
+        """Write ``batch`` with write_batch and add the changes to the totals; return the changes."""
+        # Écriture et mise à jour sous le même verrou : un rechargement entre les deux
+        # lirait le lot déjà validé, qui serait alors compté deux fois
+        with self._lock:
+            totals = write_batch(self.path, batch)
+            if self._loaded_at is not None:
+                for listing_id, (count, total) in totals.items():
+                    previous_count, previous_total = self._totals.get(listing_id, (0, 0))
+                    self._totals[listing_id] = (previous_count + count, previous_total + total)
+        return totals
+
+    def get(self, listing_id):
+        """Return the (count, sum) of ``listing_id``."""
+        with self._lock:
+            return self._fresh().get(int(listing_id), (0, 0))
+
+    def scores(self, listing_ids, prior_mean=PRIOR_MEAN, prior_weight=PRIOR_WEIGHT):
+        """Return the counts and the Bayesian-smoothed mean ratings of ``listing_ids`` as arrays."""
+        with self._lock:
+            totals = self._fresh()
+            pairs = [totals.get(listing_id, (0, 0)) for listing_id in listing_ids.tolist()]
+        counts, sums = np.array(pairs, dtype=float).reshape(-1, 2).T
+        return counts, (prior_weight * prior_mean + sums) / (prior_weight + counts)
+
+
+_queue = None
+_queue_lock = threading.Lock()
+_stats = {}
+
+
+def get_queue():
+    """The process-wide queue, shared by every session of the app."""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = RatingQueue()
+            atexit.register(_queue.flush)
+        return _queue
+
+
+def get_stats(path=RATINGS_DB):
+    with _queue_lock:
+        if path not in _stats:
+            _stats[path] = RatingStats(path)
+        return _stats[path]
+
+
+def submit(listing_id, rater_id, rating):
+    get_queue().submit(listing_id, rater_id, rating)
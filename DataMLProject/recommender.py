@@ -0,0 +1,148 @@
+"""Recommendation logic shared by mlapp.py and the Django API.
+
+Nothing here imports Streamlit, so the API can serve recommendations
+without starting a dashboard session.
+"""
+import math
+
+import numpy as np
+import pandas as pd
+
+import data_access
+import ml_models
+import ratings
+
+# Variables du clustering KMeans
+CLUSTER_FEATURES = ['price', 'beds']
+N_CLUSTERS = 15
+
+# Variables proposées pour la recherche par plus proches voisins
+NEIGHBOUR_FEATURES = ['price', 'beds', 'review_scores_rating', 'availability_365', 'latitude', 'longitude']
+
+# Colonnes nécessaires au système de recommandation
+COLUMNS = ['id', 'country', 'room_type'] + NEIGHBOUR_FEATURES
+
+# Colonnes affichées, chargées par identifiant pour les seuls logements recommandés
+DISPLAY_COLUMNS = ['id', 'name', 'listing_url', 'picture_url', 'price']
+
+# Nombre de logements par page de recommandations
+PAGE_SIZE = 10
+
+KMEANS = 'kmeans'
+NEIGHBOURS = 'neighbours'
+
+# Logements re-classés et paginés par recherche (les plus proches du prix ou des critères voulus) :
+# au plus RERANK_CANDIDATES / PAGE_SIZE pages, la dernière page a next_page à None
+RERANK_CANDIDATES = 200
+
+# Poids du score de re-classement (écart au prix voulu, note des voyageurs, notes des visiteurs)
+RANKING_WEIGHTS = {'price': 0.5, 'reviews': 0.3, 'ratings': 0.2}
+REVIEW_SCALE = 5.0
+
+
+def load_data():
+    return ml_models.clean_prices(data_access.load_columns(COLUMNS))
+
+
+def load_country_data(country):
+    # Seule la partition du pays est lue
+    return ml_models.clean_prices(data_access.load_country(COLUMNS, country))
+
+
+def select_slice(df, country, room_type):
+    return df[(df['country'] == country) & (df['room_type'] == room_type)].copy()
+
+
+def get_clustering(data, country, room_type, features_list, n_clusters=N_CLUSTERS):
+    # Le modèle n'est réentraîné que si le pays, le type de chambre, les variables ou les données changent
+    data_version = data_access.get_data_version()
+    key = ml_models.model_key(country, room_type, features_list, n_clusters, data_version)
+    return ml_models.model_cache.get_or_fit(
+        key, lambda: ml_models.fit_cluster_model(data, features_list, n_clusters, data_version))
+
+
+def get_neighbour_model(data, country, room_type, features_list):
+    # Index des plus proches voisins, réutilisé tant que les données et les variables ne changent pas
+    data_version = data_access.get_data_version()
+    key = ml_models.neighbour_key(country, room_type, features_list, data_version)
+    return ml_models.model_cache.get_or_fit(
+        key, lambda: ml_models.fit_neighbour_model(data, features_list, data_version))
+
+
+def complete_rows(data, features):
+    # Lignes utilisables par les modèles : ceux-ci ignorent les logements sans valeur pour une variable
+    return int(data[features].notna().all(axis=1).sum())
+
+
+def can_cluster(data, features=CLUSTER_FEATURES, n_clusters=N_CLUSTERS):
+    return complete_rows(data, features) >= n_clusters
+
+
+def find_nearest_cluster(model, user_input, scaler, features_list):
+    user_df = pd.DataFrame([user_input], columns=features_list)
+    scaled_input = scaler.transform(user_df)
+    cluster = model.predict(scaled_input)[0]
+    return cluster
+
+
+def rerank(ids, prices, reviews, target_price, stats=None, weights=RANKING_WEIGHTS):
+    """Return ``ids`` ordered by a blended score, best first.
+
+    The score mixes the closeness of the price to ``target_price``, the
+    review score and the Bayesian-smoothed visitor rating, each in [0, 1];
+    a missing review score counts as the middle of the scale.
+    """
+    stats = stats or ratings.get_stats()
+    price_score = 1 / (1 + np.abs(prices - target_price) / max(abs(target_price), 1))
+    review_score = np.nan_to_num(reviews / REVIEW_SCALE, nan=0.5)
+    _, rating_mean = stats.scores(ids)
+    score = (weights['price'] * price_score + weights['reviews'] * review_score
+             + weights['ratings'] * (rating_mean - 1) / 4)
+    # Tri stable : à score égal, l'ordre des candidats (prix ou distance) est conservé
+    return ids[np.argsort(-score, kind='stable')]
+
+
+def ranked_page(candidates, target_price, page=1, page_size=PAGE_SIZE):
+    """Return the ids of one page of re-ranked ``candidates`` (ids, prices, reviews) and the page count."""
+    ids = rerank(*candidates, target_price)
+    n_pages = max(1, math.ceil(len(ids) / page_size))
+    return ids[(page - 1) * page_size:page * page_size], n_pages
+
+
+def recommend(country, room_type, preferences, backend=KMEANS, page=1, page_size=PAGE_SIZE):
+    """Return one page of recommended listings for ``preferences`` ({feature: value}).
+
+    The result is a dict with the listings (DISPLAY_COLUMNS), the page count,
+    the next page (None on the last one), the backend used and, for the
+    KMeans backend, the matched cluster. Only the RERANK_CANDIDATES listings
+    closest to the preferences are ranked, so there are at most
+    RERANK_CANDIDATES / page_size pages. A
+    slice with fewer complete listings than clusters is searched by nearest
+    neighbours instead.
+    """
+    ml_models.model_cache.warm(data_access.get_data_version())
+    data = select_slice(load_country_data(country), country, room_type)
+    if data.empty:
+        raise LookupError(f"No listing for {country} / {room_type}")
+    if backend == KMEANS and not can_cluster(data):
+        backend = NEIGHBOURS
+    cluster = None
+    if backend == KMEANS:
+        features = CLUSTER_FEATURES
+        user_input = [preferences.get(feature, data[feature].mean()) for feature in features]
+        model = get_clustering(data, country, room_type, features)
+        cluster = int(find_nearest_cluster(model.kmeans, user_input, model.scaler, features))
+        target_price = preferences.get('price', data['price'].mean())
+        candidates = model.candidates(cluster, target_price, RERANK_CANDIDATES)
+    else:
+        features = [feature for feature in NEIGHBOUR_FEATURES if feature in preferences] or CLUSTER_FEATURES
+        if not complete_rows(data, features):
+            raise LookupError(f"No listing with {', '.join(features)} for {country} / {room_type}")
+        user_input = [preferences.get(feature, data[feature].mean()) for feature in features]
+        model = get_neighbour_model(data, country, room_type, features)
+        target_price = preferences.get('price', data['price'].mean())
+        candidates = model.candidates(user_input, RERANK_CANDIDATES)
+    listing_ids, n_pages = ranked_page(candidates, target_price, page, page_size)
+    listings = ml_models.clean_prices(data_access.load_listings(listing_ids, DISPLAY_COLUMNS))
+    return {'listings': listings, 'page': page, 'n_pages': n_pages, 'next_page': page + 1 if page < n_pages else None,
+            'backend': backend, 'cluster': cluster}
@@ -0,0 +1,123 @@
+"""Storage schema of merged_data.
+
+The table is created with explicit column types instead of the ones pandas
+would guess: ``id`` is the INTEGER PRIMARY KEY (so it is also the rowid used
+by the spatial index and the API cursors), prices are REAL, and dates are
+ISO 'YYYY-MM-DD' text, which sorts and compares chronologically in SQL.
+
+SQLite has no dictionary encoding, so the low-cardinality text columns are
+stored as TEXT and become pandas categoricals when loaded back.
+"""
+import numpy as np
+import pandas as pd
+
+TABLE_NAME = 'merged_data'
+
+COLUMN_TYPES = {
+    'id': 'INTEGER PRIMARY KEY',
+    'listing_url': 'TEXT',
+    'name': 'TEXT',
+    'picture_url': 'TEXT',
+    'neighborhood_overview': 'TEXT',
+    'host_since': 'TEXT',
+    'host_is_superhost': 'TEXT',
+    'neighbourhood_cleansed': 'TEXT',
+    'latitude': 'REAL',
+    'longitude': 'REAL',
+    'property_type': 'TEXT',
+    'room_type': 'TEXT',
+    'accommodates': 'REAL',
+    'beds': 'REAL',
+    'price': 'REAL',
+    'availability_365': 'REAL',
+    'number_of_reviews': 'REAL',
+    'last_scraped': 'TEXT',
+    'calendar_last_scraped': 'TEXT',
+    'first_review': 'TEXT',
+    'last_review': 'TEXT',
+    'review_scores_rating': 'REAL',
+    'review_scores_value': 'REAL',
+    'review_count': 'INTEGER',
+    'city': 'TEXT',
+    'department': 'TEXT',
+    'country': 'TEXT',
+    'source_city': 'TEXT',
+}
+
+# Colonnes à faible cardinalité, chargées en catégories
+CATEGORY_COLUMNS = ['country', 'city', 'department', 'room_type', 'property_type', 'neighbourhood_cleansed',
+                    'host_is_superhost', 'source_city']
+
+# Dates stockées au format ISO, chargées en datetime64
+DATE_COLUMNS = ['host_since', 'last_scraped', 'calendar_last_scraped', 'first_review', 'last_review']
+DATE_FORMAT = '%Y-%m-%d'
+
+# Colonnes filtrées par app.py, mlapp.py, l'API et l'ingestion incrémentale
+INDEXES = {
+    'idx_merged_data_source_city': ['source_city'],
+    'idx_merged_data_country_room_type': ['country', 'room_type'],
+    'idx_merged_data_country_neighbourhood': ['country', 'neighbourhood_cleansed'],
+}
+
+
+def quote(column):
+    return '"' + column.replace('"', '""') + '"'
+
+
+def column_type(column, dtype):
+    if column in COLUMN_TYPES:
+        return COLUMN_TYPES[column]
+    # Colonnes supplémentaires du mode non streaming : type déduit de pandas
+    if pd.api.types.is_bool_dtype(dtype) or pd.api.types.is_integer_dtype(dtype):
+        return 'INTEGER'
+    if pd.api.types.is_float_dtype(dtype):
+        return 'REAL'
+    return 'TEXT'
+
+
+def create_table(conn, df, table=TABLE_NAME):
+    """Create ``table`` for the columns of ``df`` with the typed schema."""
+    columns = ', '.join(f'{quote(col)} {column_type(col, df[col].dtype)}' for col in df.columns)
+    conn.exec_driver_sql(f"CREATE TABLE {table} ({columns})")
+
+
+def create_indexes(conn, table=TABLE_NAME):
+    for name, columns in INDEXES.items():
+        conn.exec_driver_sql(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({', '.join(columns)})")
+
+
+def has_typed_schema(conn, table=TABLE_NAME):
+    # Les bases écrites par df.to_sql n'ont pas de clé primaire sur id
+    return any(row[1] == 'id' and row[5] for row in conn.exec_driver_sql(f"PRAGMA table_info({table})"))
+
+
+def insert_or_replace(pd_table, conn, keys, data_iter):
+    """``DataFrame.to_sql`` insertion method: a listing id already stored is replaced."""
+    query = (f"INSERT OR REPLACE INTO {quote(pd_table.name)} ({', '.join(quote(key) for key in keys)}) "
+             f"VALUES ({', '.join('?' * len(keys))})")
+    conn.exec_driver_sql(query, list(data_iter))
+
+
+def to_storage(df):
+    """Return ``df`` with its datetime columns as ISO date text, the format stored in SQLite."""
+    dates = [col for col in df.columns if pd.api.types.is_datetime64_any_dtype(df[col])]
+    if not dates:
+        return df
+    df = df.copy(deep=False)
+    for col in dates:
+        values = df[col].to_numpy(dtype='datetime64[D]')
+        text = np.datetime_as_string(values, unit='D').astype(object)
+        text[np.isnat(values)] = None
+        # dtype objet explicite : pandas inférerait des chaînes avec NaN au lieu de None
+        df[col] = pd.Series(text, index=df.index, dtype=object)
+    return df
+
+
+def apply_dtypes(df):
+    """Give the columns loaded from merged_data their pandas dtypes."""
+    for col in df.columns:
+        if col in CATEGORY_COLUMNS:
+            df[col] = df[col].astype('category')
+        elif col in DATE_COLUMNS:
+            df[col] = pd.to_datetime(df[col], format=DATE_FORMAT, errors='coerce')
+    return df
@@ -0,0 +1,98 @@
+"""Viewport and radius queries on listings, backed by an SQLite R*Tree.
+
+prepare_data.py rebuilds the ``listings_rtree`` table after each ingest. Its
+ids are merged_data rowids, so the index also covers tables where the same
+listing id appears on several rows.
+"""
+import math
+import threading
+
+import numpy as np
+import pandas as pd
+
+import data_access
+from db import create_connection
+
+RTREE_TABLE = 'listings_rtree'
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = 111.32
+
+DEFAULT_COLUMNS = ['id', 'latitude', 'longitude']
+
+_local = threading.local()
+
+
+def build_spatial_index(conn):
+    """(Re)build the R*Tree from merged_data inside the caller's transaction."""
+    conn.exec_driver_sql(f"DROP TABLE IF EXISTS {RTREE_TABLE}")
+    conn.exec_driver_sql(
+        f"CREATE VIRTUAL TABLE {RTREE_TABLE} USING rtree(id, min_lat, max_lat, min_lon, max_lon)")
+    conn.exec_driver_sql(
+        f"INSERT INTO {RTREE_TABLE} (id, min_lat, max_lat, min_lon, max_lon) "
+        "SELECT rowid, latitude, latitude, longitude, longitude FROM merged_data "
+        "WHERE latitude IS NOT NULL AND longitude IS NOT NULL")
+
+
+def _connection():
+    # One sqlite3 connection per thread: no pool or ORM overhead on the hot path
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = _local.conn = create_connection(data_access.DB_PATH, readonly=True)
+    return conn
+
+
+def _has_rtree(conn):
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = ?", (RTREE_TABLE,)).fetchone() is not None
+
+
+def _query_bbox(min_lat, min_lon, max_lat, max_lon, columns):
+    conn = _connection()
+    select = ', '.join(f'm."{col}"' for col in columns)
+    if _has_rtree(conn):
+        # The R*Tree stores 32-bit bounds: keep an exact test on the real coordinates
+        query = (f"SELECT {select} FROM {RTREE_TABLE} r JOIN merged_data m ON m.rowid = r.id "
+                 "WHERE r.max_lat >= ? AND r.min_lat <= ? AND r.max_lon >= ? AND r.min_lon <= ? "
+                 "AND m.latitude BETWEEN ? AND ? AND m.longitude BETWEEN ? AND ?")
+        params = (min_lat, max_lat, min_lon, max_lon, min_lat, max_lat, min_lon, max_lon)
+    else:
+        query = (f"SELECT {select} FROM merged_data m "
+                 "WHERE m.latitude BETWEEN ? AND ? AND m.longitude BETWEEN ? AND ?")
+        params = (min_lat, max_lat, min_lon, max_lon)
+    return conn.execute(query, params).fetchall()
+
+
+def listings_in_bbox(min_lat, min_lon, max_lat, max_lon, columns=DEFAULT_COLUMNS):
+    """Return the listings whose coordinates fall inside the bounding box."""
+    rows = _query_bbox(min_lat, min_lon, max_lat, max_lon, columns)
+    return pd.DataFrame.from_records(rows, columns=columns)
+
+
+def haversine_km(lat, lon, latitudes, longitudes):
+    lat, lon = math.radians(lat), math.radians(lon)
+    latitudes, longitudes = np.radians(latitudes), np.radians(longitudes)
+    a = (np.sin((latitudes - lat) / 2) ** 2
+         + math.cos(lat) * np.cos(latitudes) * np.sin((longitudes - lon) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+def listings_within(lat, lon, radius_km, columns=DEFAULT_COLUMNS, limit=None):
+    """Return the listings within ``radius_km`` of a point, nearest first.
+
+    The result has an extra ``distance_km`` column.
+    """
+    lat_delta = radius_km / KM_PER_DEGREE
+    lon_delta = radius_km / (KM_PER_DEGREE * max(math.cos(math.radians(lat)), 1e-6))
+    columns = list(columns)
+    # Coordinates are fetched first so the distances are computed on plain arrays
+    rows = _query_bbox(lat - lat_delta, lon - lon_delta, lat + lat_delta, lon + lon_delta,
+                       ['latitude', 'longitude'] + columns)
+    coords = np.array([row[:2] for row in rows], dtype=float).reshape(-1, 2)
+
+    # The box is only a pre-filter: keep the points inside the circle, nearest first
+    distances = haversine_km(lat, lon, coords[:, 0], coords[:, 1])
+    order = np.argsort(distances, kind='stable')
+    order = order[distances[order] <= radius_km][:limit]
+    df = pd.DataFrame.from_records([rows[i][2:] for i in order], columns=columns)
+    df['distance_km'] = distances[order]
+    return df
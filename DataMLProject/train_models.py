@@ -0,0 +1,68 @@
+import argparse
+import logging
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import data_access
+import ml_models
+import recommender
+
+logger = logging.getLogger(__name__)
+
+# Variables utilisées par mlapp.py pour le clustering
+FEATURES = recommender.CLUSTER_FEATURES
+N_CLUSTERS = recommender.N_CLUSTERS
+
+
+def fit_group(country, room_type, data, features, n_clusters, data_version):
+    return country, room_type, ml_models.fit_cluster_model(data, features, n_clusters, data_version)
+
+
+def train_all(features=FEATURES, n_clusters=N_CLUSTERS, workers=None, model_dir=ml_models.MODEL_DIR):
+    """Fit one model per (country, room_type) of merged_data and store them in the registry."""
+    start = time.perf_counter()
+    data_version = data_access.get_data_version()
+    registry = ml_models.ModelCache(persist_dir=model_dir)
+    # Same rows and price cleaning as the recommender, so the stored ids line up
+    df = recommender.load_data()
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = []
+        for (country, room_type), group in df.groupby(['country', 'room_type'], sort=True, observed=True):
+            # Seules les lignes sans valeur manquante sont gardées par fit_cluster_model
+            complete = recommender.complete_rows(group, features)
+            if complete < n_clusters:
+                logger.info("%s / %s: %d complete rows, fewer than %d clusters, skipped",
+                            country, room_type, complete, n_clusters)
+                continue
+            columns = list(dict.fromkeys(['id', 'original_price'] + features))
+            futures.append(pool.submit(fit_group, country, room_type, group[columns].copy(),
+                                       features, n_clusters, data_version))
+
+        for future in as_completed(futures):
+            country, room_type, model = future.result()
+            registry.put(ml_models.model_key(country, room_type, features, n_clusters, data_version), model)
+            logger.info("%s / %s: %d rows, inertia %.1f, fitted in %.2fs", country, room_type,
+                        model.metadata['n_rows'], model.metadata['inertia'], model.metadata['fit_seconds'])
+
+    logger.info("Trained %d models for data version %s in %.2fs", len(futures), data_version,
+                time.perf_counter() - start)
+    # Les modèles d'une version précédente des données ne seraient plus jamais chargés
+    pruned = registry.prune(data_version)
+    if pruned:
+        logger.info("Removed %d stale models from %s", pruned, model_dir)
+    return len(futures)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Pre-train the recommender models for every country and room type")
+    parser.add_argument('--workers', type=int, default=None, help="number of training processes (default: all cores)")
+    parser.add_argument('--n-clusters', type=int, default=N_CLUSTERS)
+    parser.add_argument('--model-dir', default=ml_models.MODEL_DIR, help="registry directory read by mlapp.py")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    args = parse_args()
+    train_all(n_clusters=args.n_clusters, workers=args.workers, model_dir=args.model_dir)